@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1') # it prints to stdout, which would get mixed in with the results
+import soundfactory as sf
+from soundfactory import Compass
+
+# builds synthetic factories and times how long they take to step, render and draw. results come out as json
+# so runs from different revisions can be compared. everything is seeded so the same arguments always build
+# and run the same factories.
+
+def conveyor_line(size):
+    # one oscillator feeding a straight line of size conveyors into an output
+    factory = sf.FactoryFloor()
+    factory.create_component(sf.Oscillator, (0,0), Compass.EAST)
+    for x in range(1, size+1):
+        factory.create_component(sf.Conveyor, (x,0), Compass.EAST)
+    factory.create_component(sf.Output, (size+1,0), Compass.NORTH)
+    return factory
+
+def oscillator_farm(size):
+    # size oscillators in rows, each with its own short conveyor into an output
+    factory = sf.FactoryFloor()
+    notes = factory_notes()
+    for i in range(size):
+        x, y = (i % 32) * 4, i // 32
+        factory.create_component(sf.Oscillator, (x,y), Compass.EAST)
+        oscillator = factory.components[(x,y)]
+        oscillator.set_setting('waveform', ['sine', 'square', 'sawtooth', 'triangle'][i % 4])
+        oscillator.set_setting('frequency', notes[i % len(notes)])
+        oscillator.settings_changed()
+        factory.create_component(sf.Conveyor, (x+1,y), Compass.EAST)
+        factory.create_component(sf.Output, (x+2,y), Compass.NORTH)
+    return factory
+
+def effect_chains(size):
+    # size rows of oscillator -> adsr -> combine -> squisher -> stretcher -> adsr -> output
+    factory = sf.FactoryFloor()
+    chain = [sf.Oscillator, sf.ADSR, sf.Combine, sf.Squisher, sf.Stretcher, sf.ADSR, sf.Output]
+    for y in range(size):
+        for x, kind in enumerate(chain):
+            factory.create_component(kind, (x,y*2), Compass.EAST if kind is not sf.Output else Compass.NORTH)
+    return factory
+
+def splitpath_tree(size):
+    # an oscillator feeding a binary tree of split paths size levels deep, with an output on every leaf
+    factory = sf.FactoryFloor()
+    width = 2 ** (size + 1)
+    factory.create_component(sf.Oscillator, (width,0), Compass.SOUTH)
+    level = [width]
+    for depth in range(size):
+        y = (depth * 2) + 1
+        spread = 2 ** (size - depth)
+        next_level = []
+        for x in level:
+            factory.create_component(sf.SplitPath, (x,y), Compass.SOUTH)
+            # a split path facing south sends blocks west then east, each along a conveyor and then down
+            for branch, direction in [(-1, Compass.WEST), (1, Compass.EAST)]:
+                for step in range(1, spread // 2):
+                    factory.create_component(sf.Conveyor, (x + (branch*step), y), direction)
+                corner = x + (branch * (spread // 2))
+                factory.create_component(sf.Conveyor, (corner, y), Compass.SOUTH)
+                factory.create_component(sf.Conveyor, (corner, y+1), Compass.SOUTH)
+                next_level.append(corner)
+        level = next_level
+    for x in level:
+        factory.create_component(sf.Output, (x, (size * 2) + 1), Compass.NORTH)
+    return factory
+
+def factory_notes():
+    return sf.Oscillator.make_settings()['frequency'].options
+
+SCENARIOS = {'conveyor_line': (conveyor_line, 10000),
+             'oscillator_farm': (oscillator_farm, 256),
+             'effect_chains': (effect_chains, 64),
+             'splitpath_tree': (splitpath_tree, 6)}
+
+class RenderTimer:
+    # wraps the DSP functions so the time spent making and changing audio is counted separately from the
+    # rest of the step
+    def __init__(self):
+        self.elapsed = 0
+        self.originals = {}
+    def install(self):
+        for name in ['oscillator', 'adsr_envelope', 'envelope', 'envelopes', 'stretch', 'mix']:
+            original = getattr(sf.DSP, name)
+            self.originals[name] = original
+            setattr(sf.DSP, name, self.timed(original))
+    def uninstall(self):
+        for name, original in self.originals.items():
+            setattr(sf.DSP, name, original)
+    def timed(self, function):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.elapsed += time.perf_counter() - started
+        return wrapper
+
+def summarise(times):
+    times = np.array(times) * 1000
+    return {'mean_ms': float(times.mean()), 'median_ms': float(np.median(times)),
+            'p95_ms': float(np.percentile(times, 95)), 'max_ms': float(times.max())}
+
+def measure_steps(factory, steps, warmup):
+    for _ in range(warmup):
+        factory.step()
+    # the same steps are run twice: timed, then again from the same state with tracemalloc on to find the
+    # peak memory, since tracing every allocation slows the steps down
+    state = factory.get_state()
+    noise = sf.DSP.rng.bit_generator.state
+    timer = RenderTimer()
+    step_times = []
+    render_times = []
+    chunks = []
+    timer.install()
+    try:
+        for _ in range(steps):
+            timer.elapsed = 0
+            started = time.perf_counter()
+            output = factory.step()
+            if output is not None:
+                render_started = time.perf_counter()
+                sf.to_pcm16(output)
+                timer.elapsed += time.perf_counter() - render_started
+            step_times.append(time.perf_counter() - started)
+            render_times.append(timer.elapsed)
+            chunks.append(len(factory.soundchunks))
+    finally:
+        timer.uninstall()
+    factory.set_state(state)
+    sf.DSP.rng.bit_generator.state = noise
+    tracemalloc.start()
+    try:
+        for _ in range(steps):
+            output = factory.step()
+            if output is not None:
+                sf.to_pcm16(output)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'step': summarise(step_times), 'render': summarise(render_times),
+            'simulate': summarise(np.array(step_times) - np.array(render_times)),
+            'peak_memory_bytes': peak_memory, 'mean_chunks': float(np.mean(chunks))}
+
+def measure_draw(factory, frames, screen_size):
+    # draws onto an offscreen surface with sdl's dummy video driver, so no display is needed
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        sf.load_ui_modules()
+    except ImportError as e:
+        return {'skipped': f'pygame not available ({e})'}
+    sf.pg.display.init()
+    sf.pg.font.init()
+    sf.pg.display.set_mode(screen_size)
+    if sf.Sprites.unknown is None:
+        sf.Sprites.load()
+    surface = sf.pg.Surface(screen_size).convert()
+    factory.viewscale = 20
+    full_times = []
+    incremental_times = []
+    for _ in range(frames):
+        factory.redraw_all()
+        factory.layers_key = None
+        started = time.perf_counter()
+        factory.draw(surface)
+        full_times.append(time.perf_counter() - started)
+    for frame in range(frames):
+        if frame % 10 == 0:
+            factory.step()
+        started = time.perf_counter()
+        factory.draw(surface)
+        incremental_times.append(time.perf_counter() - started)
+    return {'full': summarise(full_times), 'incremental': summarise(incremental_times)}
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scenarios, sizes=None, steps=50, warmup=10, frames=30, draw=True, seed=0, workers=1, steady_state=False):
+    results = {'revision': revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+               'steps': steps, 'warmup': warmup, 'seed': seed, 'workers': workers, 'steady_state': steady_state, 'scenarios': {}}
+    parallel = sf.ParallelDSP(workers) if workers > 1 else None
+    for name in scenarios:
+        build, size = SCENARIOS[name]
+        size = (sizes or {}).get(name, size)
+        sf.DSP.rng = np.random.default_rng(seed)
+        sf.Oscillator.waveform_cache.clear()
+        started = time.perf_counter()
+        factory = build(size)
+        result = {'size': size, 'components': len(factory.components),
+                  'build_ms': (time.perf_counter() - started) * 1000}
+        factory.parallel = parallel
+        if not steady_state: # most of these settle into a loop quickly, after which there'd be nothing left to time
+            factory.steady_state = None
+        result.update(measure_steps(factory, steps, warmup))
+        if draw:
+            result['draw'] = measure_draw(factory, frames, (1000,600))
+        results['scenarios'][name] = result
+    if parallel is not None:
+        parallel.close()
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='benchmark the sound factory on synthetic factories.')
+    parser.add_argument('scenarios', nargs='*', help=f'which factories to run, out of {", ".join(SCENARIOS)} (default all)')
+    parser.add_argument('--size', action='append', default=[], metavar='SCENARIO=SIZE',
+                        help='override the size of a scenario, e.g. --size splitpath_tree=8 (can be given more than once)')
+    parser.add_argument('--steps', type=int, default=50, help='steps to time (default 50)')
+    parser.add_argument('--warmup', type=int, default=10, help='steps to run before timing (default 10)')
+    parser.add_argument('--frames', type=int, default=30, help='frames to draw (default 30)')
+    parser.add_argument('--no-draw', action='store_true', help='skip timing FactoryFloor.draw')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=1, help='processes to spread the audio processing over (default 1)')
+    parser.add_argument('--steady-state', action='store_true', help='replay steps once a factory settles into a loop, as it would normally')
+    parser.add_argument('-o', '--output', help='write the results to this file instead of printing them')
+    args = parser.parse_args(args)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario: {name}')
+    sizes = {}
+    for size in args.size:
+        name, _, value = size.partition('=')
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario: {name}')
+        try:
+            sizes[name] = int(value)
+        except ValueError:
+            parser.error(f'sizes should be whole numbers: {size}')
+    results = run_benchmarks(args.scenarios or list(SCENARIOS), sizes, args.steps, args.warmup, args.frames,
+                             not args.no_draw, args.seed, args.workers, args.steady_state)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
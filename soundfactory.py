@@ -1,15 +1,50 @@
 import math
-import gensound
-from gensound.effects import Stretch
-import pygame as pg
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import os
+import sys
+import time
+import argparse
 import pickle
+import json
+import io
+import struct
+import zlib
+import threading
+import asyncio
+import contextlib
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+from collections import OrderedDict, defaultdict, deque
+import numpy as np
+
+# pygame and tkinter are only needed for the UI, so they aren't imported until it starts. this lets the
+# simulation run headless (eg. on a server with no display) by importing this file as a library.
+pg = None
+tk = None
+filedialog = None
+messagebox = None
+
+SAMPLE_RATE = 44100
+
+def load_ui_modules():
+    global pg, tk, filedialog, messagebox
+    import pygame as pg
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
 
 class Sprites:
     font = None
-    unknown = pg.image.load('include/unknown.png')
-    component_sprites = {
+    unknown = None
+    component_sprites = {}
+    icon_sprites = {}
+    text_sprites = {} # place to put text sprites because we can't pickle surfaces
+    atlas = {} # rotated and scaled sprites, keyed by (kind, name, direction, size)
+    chunk_tiles = {} # translucent squares for drawing chunks, keyed by (colour, size)
+    viewscale = None # size the factory floor's sprites in the atlas were made for
+    ui_sizes = (40, 50) # sizes used by the buttons and menus, which are kept whatever the viewscale
+    def load():
+        Sprites.unknown = pg.image.load('include/unknown.png')
+        Sprites.component_sprites = {
             'conveyor': pg.image.load('include/conveyor.png'),
             'sine_generator': pg.image.load('include/sinegen.png'),
             'sawtooth_generator': pg.image.load('include/sawtoothgen.png'),
@@ -24,12 +59,39 @@ class Sprites:
             'delay': pg.image.load('include/delay.png'),
             'splitpath': pg.image.load('include/splitpath.png'),
             'squish': pg.image.load('include/squish.png'),
-            'stretch': pg.image.load('include/stretch.png')}
-    icon_sprites = {
-        'settings': pg.image.load('include/settings.png'),
-        'pause': pg.image.load('include/pause.png'),
-        'play': pg.image.load('include/play.png')}
-    text_sprites = {} # place to put text sprites because we can't pickle surfaces
+            'stretch': pg.image.load('include/stretch.png'),
+            'sample': pg.image.load('include/sample.png')}
+        Sprites.icon_sprites = {
+            'settings': pg.image.load('include/settings.png'),
+            'pause': pg.image.load('include/pause.png'),
+            'play': pg.image.load('include/play.png')}
+        Sprites.unknown = Sprites.unknown.convert_alpha()
+        for sprites in [Sprites.component_sprites, Sprites.icon_sprites]:
+            for name in sprites:
+                sprites[name] = sprites[name].convert_alpha()
+    def get_transformed(kind, name, direction, size):
+        # the sprite rotated to face direction (they're drawn facing north) and scaled to size x size
+        key = (kind, name, direction, size)
+        if key not in Sprites.atlas:
+            angle = {Compass.NORTH: 0, Compass.EAST: 270, Compass.SOUTH: 180, Compass.WEST: 90}[direction]
+            Sprites.atlas[key] = pg.transform.scale(pg.transform.rotate(Sprites.get_sprite(kind, name), angle), (size, size)).convert_alpha()
+        return Sprites.atlas[key]
+    def get_chunk_tile(colour, size):
+        key = (tuple(int(c) for c in colour), size)
+        if key not in Sprites.chunk_tiles:
+            if len(Sprites.chunk_tiles) > 1024: # colours drift as chunks pass through components, so don't let these pile up
+                Sprites.chunk_tiles.clear()
+            tile = pg.Surface((size, size)).convert()
+            tile.fill(key[0])
+            tile.set_alpha(128)
+            Sprites.chunk_tiles[key] = tile
+        return Sprites.chunk_tiles[key]
+    def set_viewscale(viewscale):
+        # throw away everything made for the old floor size
+        if viewscale != Sprites.viewscale:
+            Sprites.atlas = {key: sprite for key, sprite in Sprites.atlas.items() if key[3] in Sprites.ui_sizes}
+            Sprites.chunk_tiles = {}
+            Sprites.viewscale = viewscale
     def get_sprite(kind, name):
         if kind == 'component':
             if name in Sprites.component_sprites:
@@ -75,59 +137,1530 @@ class Compass:
         elif direction == Compass.EAST:
             return Compass.NORTH
 
+class DSP:
+    # blocks of sound are plain float32 arrays of samples, and everything that makes or changes them lives here.
+    # each of these does its work immediately, so the cost of processing a block doesn't depend on its history.
+    rng = np.random.default_rng()
+    waveforms = {'sine': np.sin,
+                 'square': lambda phase: np.where(phase % (2*np.pi) < np.pi, 1, -1),
+                 'sawtooth': lambda phase: ((phase + np.pi) % (2*np.pi)) / np.pi - 1,
+                 'triangle': lambda phase: 2 * np.abs((phase - 0.5*np.pi) % (2*np.pi) - np.pi) / np.pi - 1}
+    def samples(seconds):
+        return round(seconds * SAMPLE_RATE)
+    def oscillator(waveform, frequency, length):
+        if waveform == 'silence':
+            return np.zeros(length, dtype=np.float32)
+        elif waveform == 'noise':
+            return (2 * DSP.rng.random(length, dtype=np.float32)) - 1
+        else:
+            phase = (2 * np.pi * frequency / SAMPLE_RATE) * np.arange(length)
+            return DSP.waveforms[waveform](phase).astype(np.float32)
+    def adsr_envelope(attack, decay, sustain, release, length):
+        # attack, decay and release are in samples and should total less than length
+        if attack + decay + release >= length: # only happens for blocks a few samples long
+            return np.zeros(length, dtype=np.float32)
+        envelope = np.full(length, sustain, dtype=np.float32)
+        envelope[:attack] = np.linspace(0, 1, attack, endpoint=False)
+        envelope[attack:attack+decay] = np.linspace(1, sustain, decay, endpoint=False)
+        envelope[length-release:] = np.linspace(sustain, 0, release)
+        return envelope
+    def envelope(signal, envelope, out=None):
+        return np.multiply(signal, envelope, out=out)
+    def envelopes(jobs):
+        # applies a lot of envelopes at once, {key: (signal, envelope)} to {key: enveloped signal}. the same
+        # signal through the same envelope (eg. from identical oscillators into identical ADSRs) is only worked
+        # out once and shared, and signals of the same length through the same envelope get one multiply.
+        groups = {}
+        for key, (signal, envelope) in jobs.items():
+            group = groups.setdefault((id(envelope), len(signal)), (envelope, {}))
+            group[1].setdefault(id(signal), (signal, []))[1].append(key)
+        results = {}
+        for envelope, signals in groups.values():
+            if len(signals) == 1:
+                signal, keys = next(iter(signals.values()))
+                block = [np.multiply(signal, envelope)]
+            else:
+                block = np.stack([signal for signal, keys in signals.values()])
+                block *= envelope
+            for row, (signal, keys) in zip(block, signals.values()):
+                for key in keys:
+                    results[key] = row
+        return results
+    sinc_taps = 16 # samples either side of each point that windowed sinc interpolation looks at, in total
+    sinc_block = 4096 # points interpolated at once, to keep the temporary arrays small
+    def stretched_length(length, rate):
+        return math.ceil(length / rate)
+    def stretch(signal, rate, quality='linear', out=None):
+        # resample so the signal plays rate times faster (so rate < 1 makes it longer). the result is always
+        # stretched_length long, i.e. len(signal) / rate rounded up, so halving the speed of a block gives exactly
+        # twice as many samples; points past the last sample hold it. the result is written
+        # into out if it's given (which should be stretched_length long, and can be a slice of a bigger array),
+        # so the squisher and stretcher can build their blocks without copying. quality is 'linear' for linear
+        # interpolation or 'sinc' for windowed sinc, which is slower but doesn't dull or alias the sound.
+        length = DSP.stretched_length(len(signal), rate)
+        if out is None:
+            out = np.empty(length, dtype=np.float32)
+        if length == 0:
+            return out
+        positions = np.arange(length) * rate
+        if quality == 'sinc':
+            half = DSP.sinc_taps // 2
+            cutoff = min(1, 1 / rate) # when speeding up, filter out what would fold back down below nyquist
+            offsets = np.arange(1 - half, half + 1)
+            for start in range(0, length, DSP.sinc_block):
+                block = positions[start:start + DSP.sinc_block]
+                taps = np.floor(block).astype(np.int64)[:,None] + offsets
+                distance = block[:,None] - taps
+                weights = cutoff * np.sinc(cutoff * distance) * (0.5 + 0.5 * np.cos(np.pi * distance / half))
+                weights[(taps < 0) | (taps >= len(signal))] = 0
+                np.einsum('ij,ij->i', signal.take(taps, mode='clip'), weights.astype(np.float32), out=out[start:start + len(block)])
+        else:
+            index = positions.astype(np.int64)
+            before = signal[index]
+            after = signal[np.minimum(index + 1, len(signal) - 1)]
+            after -= before
+            after *= (positions - index).astype(np.float32)
+            np.add(before, after, out=out)
+        return out
+    def squish(first, second, quality='linear', out=None):
+        # both halves are resampled straight into their place in the new block
+        first_length = DSP.stretched_length(len(first), 2)
+        if out is None:
+            out = np.empty(first_length + DSP.stretched_length(len(second), 2), dtype=np.float32)
+        DSP.stretch(first, 2, quality, out[:first_length])
+        DSP.stretch(second, 2, quality, out[first_length:])
+        return out
+    def mix(signals, out=None):
+        if out is None:
+            mixed = np.zeros(max(len(signal) for signal in signals), dtype=np.float32)
+        else:
+            mixed = out
+            mixed.fill(0)
+        for signal in signals:
+            mixed[:len(signal)] += signal
+        return mixed
+    def pan_mix(signals, pans, out=None):
+        # mixes signals into stereo, with each one's pan from -1 (left) to 1 (right). equal power, so a signal
+        # in the middle comes out of each side at 1/sqrt(2)
+        if out is None:
+            mixed = np.zeros((max(len(signal) for signal in signals), 2), dtype=np.float32)
+        else:
+            mixed = out
+            mixed.fill(0)
+        angles = (np.asarray(pans) + 1) * (np.pi / 4)
+        gains = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+        for signal, gain in zip(signals, gains):
+            mixed[:len(signal)] += signal[:,None] * gain
+        return mixed
+    def soft_limit(samples, threshold):
+        # in place, leaves anything quieter than threshold alone and eases the rest in towards full scale rather
+        # than clipping it off
+        magnitude = np.abs(samples)
+        over = magnitude > threshold
+        if over.any():
+            squashed = threshold + ((1 - threshold) * np.tanh((magnitude[over] - threshold) / (1 - threshold)))
+            samples[over] = np.copysign(squashed, samples[over])
+        return samples
+
+class Mixer:
+    # the last part of a step, where the blocks that reached outputs this step are mixed into one. they're all
+    # added into a single buffer, so it costs the same per output however many there are, then the gain's
+    # applied and the soft limiter (if it's on) eases peaks back under full scale instead of letting them clip.
+    # with a stereo width, the mix comes out in stereo with each output panned by how far across the floor it
+    # is, from the leftmost output to the rightmost. it's set up from the factory's settings when they change.
+    limit_threshold = 0.8 # the limiter doesn't touch anything quieter than this
+    def __init__(self):
+        self.gain = 1
+        self.limiter = 'off'
+        self.stereo_width = 0 # 0 for mono, up to 1 to pan the outputs furthest out all the way to the sides
+        self.span = None # the leftmost and rightmost outputs' x, worked out when the layout changes
+        self.span_key = None
+        self.mix_buffer = None # what the mix is worked out in, kept between steps and only grown when it has to be
+    @property
+    def channels(self):
+        return 1 if self.stereo_width == 0 else 2
+    def configure(self, settings):
+        self.gain = settings['gain'].get_value()
+        self.limiter = settings['limiter'].get_value()
+        self.stereo_width = settings['stereo width'].get_value()
+    def pan(self, factory, location):
+        if self.span_key != factory.layout_version:
+            xs = [component.location[0] for component in factory.components.of_kinds([Output])]
+            self.span = (min(xs), max(xs)) if len(xs) > 0 else (0, 0)
+            self.span_key = factory.layout_version
+        centre = (self.span[0] + self.span[1]) / 2
+        half = max(1, (self.span[1] - self.span[0]) / 2)
+        return self.stereo_width * min(1, max(-1, (location[0] - centre) / half))
+    def buffer(self, length):
+        # the first length samples of the mix buffer, which is remade if it's too short or has the wrong
+        # number of channels
+        shape = (length,) if self.channels == 1 else (length, 2)
+        if self.mix_buffer is None or self.mix_buffer.shape[1:] != shape[1:] or len(self.mix_buffer) < length:
+            self.mix_buffer = np.zeros(shape, dtype=np.float32)
+        return self.mix_buffer[:length]
+    def mix(self, factory, outputs):
+        # outputs is a list of (location of the output, signal). the gain and limiter are applied in the mix
+        # buffer, and what's returned is a copy of it, since the steps rendered ahead and the steady state's
+        # recording hold on to each step's mix
+        signals = [signal for location, signal in outputs]
+        out = self.buffer(max(len(signal) for signal in signals))
+        if self.channels == 1:
+            mixed = DSP.mix(signals, out=out)
+        else:
+            mixed = DSP.pan_mix(signals, [self.pan(factory, location) for location, signal in outputs], out=out)
+        if self.gain != 1:
+            mixed *= self.gain
+        if self.limiter == 'soft':
+            DSP.soft_limit(mixed, Mixer.limit_threshold)
+        return mixed.copy()
+
+class WaveformCache:
+    # least-recently-used store of rendered blocks. the blocks are made read-only since every oscillator
+    # that asks for the same key gets the same array.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def get(self, key, make):
+        if key in self.blocks:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return self.blocks[key]
+        self.misses += 1
+        block = make()
+        block.flags.writeable = False
+        self.blocks[key] = block
+        if len(self.blocks) > self.maxsize:
+            self.blocks.popitem(last=False)
+        return block
+    def clear(self):
+        self.blocks.clear()
+
+class SampleFile:
+    # a wav or raw pcm file mapped into memory rather than read in, so a recording much bigger than memory can be
+    # played a block at a time and the os pages it in and out as it goes. blocks of a float32 mono file at
+    # SAMPLE_RATE are views of the mapping itself; anything else has just the frames for the block converted.
+    # every sample player playing a file shares one SampleFile for it (see SampleFile.open). files ending in
+    # one of raw_extensions are read as raw 16-bit mono at SAMPLE_RATE; anything else has to be a wav file.
+    raw_extensions = ['.raw', '.pcm']
+    mapped = {} # filename: SampleFile, or None if it couldn't be opened
+    dtypes = {(1, 8): 'u1', (1, 16): '<i2', (1, 24): 'u1', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8'} # (format, bits): dtype
+    def __init__(self, filename, offset, frames, channels, rate, dtype, bits):
+        self.filename = filename
+        self.channels = channels
+        self.rate = rate
+        self.bits = bits
+        self.length = frames
+        if frames == 0:
+            raise ValueError('it has no samples')
+        # 24-bit samples are mapped as their 3 bytes and put together when a block's converted
+        shape = (frames, channels, 3) if bits == 24 else (frames, channels)
+        self.samples = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    def open(filename):
+        if filename not in SampleFile.mapped:
+            try:
+                SampleFile.mapped[filename] = SampleFile.read_header(filename)
+            except (OSError, ValueError, struct.error) as e:
+                print(f'WARNING: could not open {filename} as a sample ({e})')
+                SampleFile.mapped[filename] = None
+        return SampleFile.mapped[filename]
+    def read_header(filename):
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as file:
+            riff = file.read(12)
+            if len(riff) < 12 or riff[:4] not in [b'RIFF', b'RF64'] or riff[8:] != b'WAVE':
+                # anything else would most likely be compressed audio, which played as pcm is loud noise
+                if os.path.splitext(filename)[1].lower() not in SampleFile.raw_extensions:
+                    raise ValueError('it isn\'t a wav file')
+                return SampleFile(filename, 0, size // 2, 1, SAMPLE_RATE, '<i2', 16)
+            fmt = None
+            data_size = None # from the ds64 chunk of an rf64 file, for ones over 4gb
+            while True:
+                header = file.read(8)
+                if len(header) < 8:
+                    raise ValueError('it has no data chunk')
+                name, chunk_size = struct.unpack('<4sI', header)
+                start = file.tell()
+                if name == b'ds64':
+                    data_size = struct.unpack('<QQ', file.read(16))[1]
+                elif name == b'fmt ':
+                    fmt = file.read(chunk_size)
+                elif name == b'data':
+                    break
+                file.seek(start + chunk_size + (chunk_size & 1)) # chunks are padded to an even length
+        if fmt is None:
+            raise ValueError('it has no fmt chunk')
+        format_tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+        if format_tag == 0xFFFE: # extensible, where the format is the start of the subformat guid
+            format_tag = struct.unpack('<H', fmt[24:26])[0]
+        if (format_tag, bits) not in SampleFile.dtypes:
+            raise ValueError(f'unsupported wav format ({format_tag}, {bits}-bit)')
+        if chunk_size == 0xFFFFFFFF and data_size is not None:
+            chunk_size = data_size
+        chunk_size = min(chunk_size, size - start) # recorders that were stopped early leave the size too big
+        return SampleFile(filename, start, chunk_size // (channels * (bits // 8)), channels, rate,
+                          SampleFile.dtypes[(format_tag, bits)], bits)
+    def frames(self, start, stop):
+        # frames start to stop as float32 mono
+        samples = self.samples[start:stop].view(np.ndarray)
+        if self.bits == 24:
+            samples = ((samples[...,0].astype(np.uint32) << 8) | (samples[...,1].astype(np.uint32) << 16) |
+                       (samples[...,2].astype(np.uint32) << 24)).view(np.int32)
+        if samples.dtype == np.float32 and self.channels == 1:
+            return samples[:,0]
+        scale = 1 if self.samples.dtype.kind == 'f' else {8: 1/128, 16: 1/32768, 24: 1/2**31, 32: 1/2**31}[self.bits]
+        if self.bits == 8: # unsigned, unlike the others
+            samples = samples.astype(np.float32) - 128
+        return (samples.mean(axis=1, dtype=np.float32) * scale).astype(np.float32)
+    def read(self, position, length, step):
+        # length samples from position (in the file's frames), taking every step'th frame. step isn't 1 when the
+        # file's rate is different, and then the samples are interpolated from the frames either side
+        if step == 1 and position == int(position):
+            return self.frames(int(position), int(position) + length)
+        positions = position + (np.arange(length) * step)
+        first = int(position)
+        frames = self.frames(first, min(int(positions[-1]) + 2, self.length)) if length > 0 else np.zeros(0, dtype=np.float32)
+        return np.interp(positions - first, np.arange(len(frames)), frames).astype(np.float32)
+
+def run_dsp_jobs(memory_name, jobs):
+    # runs in a ParallelDSP worker. arrays are passed as (start, length) in the shared memory block, and each
+    # job writes its result into the space after its inputs.
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        samples = np.ndarray((memory.size // 4,), dtype=np.float32, buffer=memory.buf)
+        for name, arguments, (start, length) in jobs:
+            arguments = [ParallelDSP.unpack(argument, samples) for argument in arguments]
+            getattr(DSP, name)(*arguments, out=samples[start:start+length])
+        del samples, arguments
+    finally:
+        memory.close()
+
+class ParallelDSP:
+    # opt-in running of the expensive part of each component's step (see FactoryComponent.job) on a pool of
+    # processes, turned on by setting FactoryFloor.parallel. the jobs in a step only depend on what was there
+    # before any component operated, so they can all run at once, and each one runs the same DSP function on
+    # the same samples as it would have in order, so the result is identical to running serially. blocks go
+    # to and from the workers through one shared memory block per step rather than being pickled.
+    output_lengths = {'envelope': lambda signal, *arguments: len(signal),
+                      'mix': lambda signals: max(len(signal) for signal in signals),
+                      'squish': lambda first, second, quality: DSP.stretched_length(len(first), 2) + DSP.stretched_length(len(second), 2),
+                      'stretch': lambda signal, rate, quality: DSP.stretched_length(len(signal), rate)}
+    min_jobs = 4 # fewer jobs than this run in this process, since handing them out costs more than it saves
+    def __init__(self, workers):
+        self.workers = workers
+        # spawned rather than forked, since the editor has audio and render-ahead threads running
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers, multiprocessing.get_context('spawn'))
+    def close(self):
+        self.pool.shutdown()
+    def pack(argument, layout):
+        # swaps arrays for their place in the shared memory block, adding them to layout (id: (start, array))
+        if isinstance(argument, np.ndarray):
+            if id(argument) not in layout: # cached waveforms mean lots of chunks share the same array
+                layout[id(argument)] = (ParallelDSP.layout_end(layout), argument)
+            return ('samples', layout[id(argument)][0], len(argument))
+        if isinstance(argument, list):
+            return [ParallelDSP.pack(item, layout) for item in argument]
+        return argument
+    def layout_end(layout):
+        # where the arrays in layout end. they're laid out in the order they were added, which the dict keeps,
+        # so that's the end of the last one
+        if len(layout) == 0:
+            return 0
+        start, array = next(reversed(layout.values()))
+        return start + len(array)
+    def unpack(argument, samples):
+        if isinstance(argument, tuple) and len(argument) == 3 and argument[0] == 'samples':
+            return samples[argument[1]:argument[1]+argument[2]]
+        if isinstance(argument, list):
+            return [ParallelDSP.unpack(item, samples) for item in argument]
+        return argument
+    def run(self, jobs):
+        # jobs is {location: (DSP function name, arguments)}, returns {location: result}
+        if len(jobs) < ParallelDSP.min_jobs:
+            return {location: getattr(DSP, name)(*arguments) for location, (name, arguments) in jobs.items()}
+        layout = {}
+        packed = {location: (name, [ParallelDSP.pack(argument, layout) for argument in arguments])
+                  for location, (name, arguments) in jobs.items()}
+        position = ParallelDSP.layout_end(layout)
+        outputs = {}
+        for location, (name, arguments) in jobs.items():
+            length = ParallelDSP.output_lengths[name](*arguments)
+            outputs[location] = (position, length)
+            position += length
+        memory = shared_memory.SharedMemory(create=True, size=max(4, position * 4))
+        try:
+            samples = np.ndarray((position,), dtype=np.float32, buffer=memory.buf)
+            for start, array in layout.values():
+                samples[start:start+len(array)] = array
+            # the jobs are dealt out biggest first to whichever worker has the least to do so far
+            batches = [[] for _ in range(self.workers)]
+            loads = [0] * self.workers
+            for location in sorted(outputs, key=lambda location: outputs[location][1], reverse=True):
+                worker = loads.index(min(loads))
+                batches[worker].append((*packed[location], outputs[location]))
+                loads[worker] += outputs[location][1]
+            futures = [self.pool.submit(run_dsp_jobs, memory.name, batch) for batch in batches if len(batch) > 0]
+            for future in futures:
+                future.result()
+            results = {location: samples[start:start+length].copy() for location, (start, length) in outputs.items()}
+            del samples
+        finally:
+            memory.close()
+            memory.unlink()
+        return results
+
+class Profiler:
+    # opt-in timing of a factory, turned on by setting FactoryFloor.profiler. records how long each component
+    # type and each tile spends operating, how long chunks take to move, how long the output mix and drawing
+    # take, and how many chunks there were each step. it can all be written out as a trace file in the chrome
+    # trace event format (which chrome://tracing and perfetto open). it times the factory as it normally runs,
+    # so conveyors handled by its Transit only show up as a whole, not tile by tile.
+    def __init__(self, max_events=200000, history=200):
+        self.started_at = time.perf_counter()
+        self.type_times = {} # type name: [total seconds, calls]
+        self.tile_times = {} # location: seconds, decaying each step so it shows what's slow lately
+        self.tile_decay = 0.9
+        self.steps = deque(maxlen=history) # dicts of timings for recent steps
+        self.draw_times = deque(maxlen=history)
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.Lock() # the factory can be stepped and drawn on different threads
+    def event(self, name, category, started, duration, args=None):
+        self.events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': threading.get_ident(),
+                            'ts': (started - self.started_at) * 1e6, 'dur': duration * 1e6, 'args': args or {}})
+    def record_operate(self, component, started, duration):
+        name = type(component).__name__
+        with self.lock:
+            totals = self.type_times.setdefault(name, [0, 0])
+            totals[0] += duration
+            totals[1] += 1
+            self.tile_times[component.location] = self.tile_times.get(component.location, 0) + duration
+        self.event(f'{name}.operate', 'operate', started, duration, {'location': component.location})
+    def record_transit(self, started, duration, conveyors):
+        # the conveyors with blocks on that were dealt with by the factory's Transit rather than operated,
+        # counted as one call per conveyor but timed as one span since they aren't done one at a time
+        if conveyors > 0:
+            with self.lock:
+                totals = self.type_times.setdefault('Conveyor', [0, 0])
+                totals[0] += duration
+                totals[1] += conveyors
+        self.event('Transit.update', 'operate', started, duration, {'conveyors': conveyors})
+    def record_move(self, chunk_location, started, duration):
+        with self.lock:
+            self.tile_times[chunk_location] = self.tile_times.get(chunk_location, 0) + duration
+        self.event('SoundChunk.move', 'move', started, duration, {'location': chunk_location})
+    def record_step(self, started, operate, move, mix, chunks, budget):
+        duration = time.perf_counter() - started
+        with self.lock:
+            self.steps.append({'duration': duration, 'operate': operate, 'move': move, 'mix': mix,
+                               'chunks': chunks, 'budget': budget})
+            self.tile_times = {location: seconds * self.tile_decay for location, seconds in self.tile_times.items()
+                               if seconds * self.tile_decay > 1e-7}
+        self.event('FactoryFloor.step', 'step', started, duration, {'chunks': chunks})
+        self.events.append({'name': 'chunks', 'ph': 'C', 'pid': 0, 'ts': (started - self.started_at) * 1e6,
+                            'args': {'chunks': chunks}})
+    def record_draw(self, started, duration):
+        self.draw_times.append(duration)
+        self.event('FactoryFloor.draw', 'draw', started, duration)
+    def slowest_tiles(self, count):
+        with self.lock:
+            return sorted(self.tile_times.items(), key=lambda item: item[1], reverse=True)[:count]
+    def dump(self, filename):
+        with self.lock:
+            events = list(self.events)
+            types = {name: {'seconds': totals[0], 'calls': totals[1]} for name, totals in self.type_times.items()}
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'component_types': types}}, file)
+
+class SparseGrid:
+    # an index from (x,y) on an unbounded floor to row numbers (see ComponentStore). it's kept in regions of
+    # region_size x region_size cells, each an array of the rows there with -1 for empty cells, so what's in
+    # an area can be found without looking at every cell in it or every row, and lookups are an array index.
+    # whole regions can be written out to disk to save memory (see spill_region), leaving only an occupancy
+    # bitmap behind so membership tests don't need them, and are read back in by loader when a row in them
+    # is looked up.
+    region_size = 32
+    def __init__(self):
+        self.regions = {} # region: int32 array of rows, indexed [y,x]
+        self.spilled = {} # region: (occupancy bitmap, whatever loader needs to read it back in)
+        self.loader = None # function taking a region and what spill_region was given, which puts its rows back
+        self.count = 0 # rows in regions that are in memory
+    def region_of(location):
+        return (location[0] // SparseGrid.region_size, location[1] // SparseGrid.region_size)
+    def __contains__(self, location):
+        region = (location[0] // SparseGrid.region_size, location[1] // SparseGrid.region_size)
+        if region in self.regions:
+            return self.regions[region][location[1] % SparseGrid.region_size, location[0] % SparseGrid.region_size] >= 0
+        return region in self.spilled and bool(self.spilled[region][0][location[1] % SparseGrid.region_size, location[0] % SparseGrid.region_size])
+    def __len__(self):
+        return self.count + sum(int(np.count_nonzero(occupancy)) for occupancy, token in self.spilled.values())
+    def get(self, location):
+        # the row at location, or -1 if there isn't one
+        x, y = location
+        rows = self.regions.get((x // SparseGrid.region_size, y // SparseGrid.region_size))
+        if rows is None:
+            region = (x // SparseGrid.region_size, y // SparseGrid.region_size)
+            if region not in self.spilled:
+                return -1
+            self.load_region(region)
+            if region not in self.regions:
+                return -1
+            rows = self.regions[region]
+        return rows.item(y % SparseGrid.region_size, x % SparseGrid.region_size)
+    def set(self, location, row):
+        region = SparseGrid.region_of(location)
+        if region in self.spilled:
+            self.load_region(region)
+        if region not in self.regions:
+            self.regions[region] = np.full((SparseGrid.region_size, SparseGrid.region_size), -1, dtype=np.int32)
+        rows = self.regions[region]
+        cell = (location[1] % SparseGrid.region_size, location[0] % SparseGrid.region_size)
+        if rows[cell] < 0:
+            self.count += 1
+        rows[cell] = row
+    def set_many(self, locations, rows):
+        # set() for an n x 2 array of locations that are all empty and an array of their rows, a region at a time
+        size = SparseGrid.region_size
+        regions = locations // size
+        order = np.lexsort((regions[:,1], regions[:,0]))
+        regions, locations, rows = regions[order], locations[order] % size, rows[order]
+        starts = np.flatnonzero(np.any(regions[1:] != regions[:-1], axis=1)) + 1
+        for start, end in zip([0] + starts.tolist(), starts.tolist() + [len(rows)]):
+            region = tuple(regions[start].tolist())
+            if region in self.spilled:
+                self.load_region(region)
+            if region not in self.regions:
+                self.regions[region] = np.full((size, size), -1, dtype=np.int32)
+            self.regions[region][locations[start:end,1], locations[start:end,0]] = rows[start:end]
+        self.count += len(rows)
+    def remove(self, location):
+        region = SparseGrid.region_of(location)
+        if region in self.spilled:
+            self.load_region(region)
+        rows = self.regions[region]
+        rows[location[1] % SparseGrid.region_size, location[0] % SparseGrid.region_size] = -1
+        self.count -= 1
+        if rows.max() < 0:
+            del self.regions[region]
+    def region_rows(self, region):
+        # (location, row) for everything in a region that's in memory
+        rows = self.regions[region]
+        x0, y0 = region[0] * SparseGrid.region_size, region[1] * SparseGrid.region_size
+        ys, xs = np.nonzero(rows >= 0)
+        return [((x + x0, y + y0), row) for x, y, row in zip(xs.tolist(), ys.tolist(), rows[ys, xs].tolist())]
+    def items(self):
+        # (location, row) for everything, reading any regions on disk back in first
+        self.load_all()
+        for region in list(self.regions):
+            yield from self.region_rows(region)
+    def resident_regions(self):
+        return list(self.regions)
+    def locations_in(self, left, top, right, bottom):
+        # filled locations with left <= x < right and top <= y < bottom
+        size = SparseGrid.region_size
+        locations = []
+        for ry in range(top // size, (bottom - 1) // size + 1):
+            for rx in range(left // size, (right - 1) // size + 1):
+                if (rx,ry) in self.regions:
+                    occupancy = self.regions[(rx,ry)] >= 0
+                elif (rx,ry) in self.spilled:
+                    occupancy = self.spilled[(rx,ry)][0]
+                else:
+                    continue
+                x0, y0 = rx * size, ry * size
+                cells = occupancy[max(0, top-y0):min(size, bottom-y0), max(0, left-x0):min(size, right-x0)]
+                for y, x in np.argwhere(cells).tolist():
+                    locations.append((x + max(x0, left), y + max(y0, top)))
+        return locations
+    def spill_region(self, region, token):
+        # forgets a region's rows once the caller has written them somewhere that token lets loader read
+        # them back in from
+        rows = self.regions.pop(region)
+        self.spilled[region] = (rows >= 0, token)
+        self.count -= int(np.count_nonzero(rows >= 0))
+    def load_region(self, region):
+        occupancy, token = self.spilled.pop(region)
+        self.loader(region, token)
+    def load_all(self):
+        for region in list(self.spilled):
+            self.load_region(region)
+
+class StoredAttribute:
+    # an attribute of a component that's kept in its factory's ComponentStore, since component objects are only
+    # views of a row there. only components where it's not the default take up any room for it. these are
+    # what changes as the factory runs, so they're what FactoryFloor.get_state captures.
+    def __init__(self, default):
+        self.default = default
+    def __set_name__(self, kind, name):
+        self.name = name
+    def __get__(self, component, kind=None):
+        if component is None:
+            return self.default
+        return component.factory.components.attributes[self.name].get(component.row, self.default)
+    def __set__(self, component, value):
+        values = component.factory.components.attributes[self.name]
+        if value is self.default or (type(value) is type(self.default) and value == self.default):
+            values.pop(component.row, None)
+        else:
+            values[component.row] = value
+
+KIND_SETTINGS = {} # see kind_settings
+
+def kind_settings(kind):
+    # ({name: (column, widget)}, default numbers) for a kind's settings. the widgets are only used to convert
+    # between values and the numbers they're stored as
+    if kind not in KIND_SETTINGS:
+        widgets = kind.make_settings()
+        KIND_SETTINGS[kind] = ({name: (column, widget) for column, (name, widget) in enumerate(widgets.items())},
+                               np.array([widget.to_number() for widget in widgets.values()], dtype=np.float64))
+    return KIND_SETTINGS[kind]
+
+def grown(array, capacity):
+    bigger = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    bigger[:len(array)] = array
+    return bigger
+
+class ComponentStore:
+    # the components on a factory floor, as a row each in a set of arrays rather than an object each, which keeps
+    # big layouts small. the FactoryComponent classes' objects are only views of a row, made when a component is
+    # looked up. kind, direction and order have an array each, settings are numbers in a table per kind (the
+    # widgets for them are only made when they're shown), and anything else goes in attributes, see
+    # StoredAttribute. it can be used like a dict of locations to components.
+    no_kind = 255 # kind of a row that's been freed
+    def __init__(self, factory):
+        self.factory = factory
+        self.grid = SparseGrid()
+        self.kinds = np.zeros(0, dtype=np.uint8) # index into COMPONENT_KINDS
+        self.directions = np.zeros(0, dtype=np.uint8) # index into DIRECTIONS
+        self.orders = np.zeros(0, dtype=np.int64)
+        self.locations = np.zeros((0,2), dtype=np.int32)
+        self.setting_rows = np.zeros(0, dtype=np.int32) # row in the kind's settings table, or -1
+        self.rows = 0 # rows used so far, including freed ones
+        self.free = [] # freed rows, which get reused
+        # the settings tables are keyed by the kind's name rather than the kind, so pickles don't refer to the classes
+        self.tables = {} # kind name: float64 array with the numbers for a component of that kind's settings in each row
+        self.table_rows = {} # kind name: rows used in its table so far
+        self.table_free = {} # kind name: freed rows in its table
+        self.attributes = defaultdict(dict) # attribute name: {row: value}, see StoredAttribute
+        self.shown_widgets = None # (row, widgets) for the component whose settings were last asked for
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shown_widgets'] = None
+        return state
+    def add(self, kind, location, direction, order):
+        if location in self.grid:
+            self.remove(location)
+        if len(self.free) > 0:
+            row = self.free.pop()
+        else:
+            self.reserve(self.rows + 1)
+            row = self.rows
+            self.rows += 1
+        self.kinds[row] = COMPONENT_KINDS.index(kind)
+        self.directions[row] = DIRECTIONS.index(direction)
+        self.orders[row] = order
+        self.locations[row] = location
+        self.setting_rows[row] = self.add_settings(kind, 1)[0]
+        self.grid.set(location, row)
+        return kind(self.factory, location, row)
+    def add_many(self, kind, locations, directions, orders):
+        # adds components of one kind in bulk, for loading, at an n x 2 array of locations that are all empty.
+        # directions are indices into DIRECTIONS. returns their rows
+        n = len(locations)
+        self.reserve(self.rows + n)
+        rows = np.arange(self.rows, self.rows + n)
+        self.rows += n
+        self.kinds[rows] = COMPONENT_KINDS.index(kind)
+        self.directions[rows] = directions
+        self.orders[rows] = orders
+        self.locations[rows] = locations
+        self.setting_rows[rows] = self.add_settings(kind, n)
+        self.grid.set_many(locations, rows)
+        return rows
+    def reserve(self, rows):
+        if rows > len(self.kinds):
+            capacity = max(64, 2 * len(self.kinds), rows)
+            self.kinds = grown(self.kinds, capacity)
+            self.directions = grown(self.directions, capacity)
+            self.orders = grown(self.orders, capacity)
+            self.locations = grown(self.locations, capacity)
+            self.setting_rows = grown(self.setting_rows, capacity)
+    def add_settings(self, kind, count):
+        # rows in kind's settings table for count new components, filled with the defaults, or -1s if it has none
+        columns, defaults = kind_settings(kind)
+        if len(columns) == 0:
+            return np.full(count, -1)
+        name = kind.__name__
+        if name not in self.tables:
+            self.tables[name] = np.zeros((0, len(columns)))
+            self.table_rows[name] = 0
+            self.table_free[name] = []
+        free = self.table_free[name]
+        reused = [free.pop() for _ in range(min(count, len(free)))]
+        fresh = count - len(reused)
+        if self.table_rows[name] + fresh > len(self.tables[name]):
+            self.tables[name] = grown(self.tables[name], max(16, 2 * len(self.tables[name]), self.table_rows[name] + fresh))
+        table_rows = np.array(reused + list(range(self.table_rows[name], self.table_rows[name] + fresh)), dtype=np.int32)
+        self.table_rows[name] += fresh
+        self.tables[name][table_rows] = defaults
+        return table_rows
+    def remove(self, location):
+        row = self.grid.get(location)
+        if row < 0:
+            return
+        self.grid.remove(location)
+        self.forget(row)
+    def forget(self, row):
+        if self.setting_rows[row] >= 0:
+            self.table_free[COMPONENT_KINDS[self.kinds[row]].__name__].append(int(self.setting_rows[row]))
+        for values in self.attributes.values():
+            values.pop(row, None)
+        if self.shown_widgets is not None and self.shown_widgets[0] == row:
+            self.shown_widgets = None
+        self.kinds[row] = ComponentStore.no_kind
+        self.free.append(row)
+    def view(self, row, location=None):
+        if location is None:
+            location = tuple(self.locations[row].tolist())
+        return COMPONENT_KINDS[self.kinds.item(row)](self.factory, location, row)
+    def __contains__(self, location):
+        return location in self.grid
+    def __getitem__(self, location):
+        row = self.grid.get(location)
+        if row < 0:
+            raise KeyError(location)
+        return self.view(row, location)
+    def get(self, location, default=None):
+        row = self.grid.get(location)
+        return default if row < 0 else self.view(row, location)
+    def __len__(self):
+        return len(self.grid)
+    def accepts(self, location):
+        # whether there's a component at location that isn't blocking input, without making a view of it
+        row = self.grid.get(location)
+        return row >= 0 and self.attributes['opengates'].get(row, True)
+    def active(self, locations):
+        # views of the components at any of locations, in the order they were created
+        rows = [(row, location) for location in locations if (row := self.grid.get(location)) >= 0]
+        if len(rows) == 0:
+            return []
+        order = np.argsort(self.orders[[row for row, location in rows]], kind='stable')
+        return [self.view(*rows[i]) for i in order.tolist()]
+    # going through everything brings every region back into memory
+    def __iter__(self):
+        return (location for location, row in self.grid.items())
+    def keys(self):
+        return iter(self)
+    def items(self):
+        return ((location, self.view(row, location)) for location, row in self.grid.items())
+    def values(self):
+        return (self.view(row, location) for location, row in self.grid.items())
+    def of_kinds(self, kinds):
+        # components of any of kinds that are in memory, found from the kinds array
+        rows = np.flatnonzero(np.isin(self.kinds[:self.rows], [COMPONENT_KINDS.index(kind) for kind in kinds]))
+        return [self.view(row, tuple(location)) for row, location in zip(rows.tolist(), self.locations[rows].tolist())]
+    def region_rows(self, region):
+        return np.array([row for location, row in self.grid.region_rows(region)], dtype=np.int64)
+    def spill_region(self, region, token):
+        # forgets the components in a region once they've been written somewhere token lets the grid's loader
+        # read them back in from
+        for location, row in self.grid.region_rows(region):
+            self.forget(row)
+        self.grid.spill_region(region, token)
+    def get_setting(self, row, kind, name):
+        column, widget = (KIND_SETTINGS.get(kind) or kind_settings(kind))[0][name]
+        return widget.value_of(self.tables[kind.__name__].item(self.setting_rows.item(row), column))
+    def set_setting(self, row, kind, name, value):
+        column, widget = kind_settings(kind)[0][name]
+        self.tables[kind.__name__][self.setting_rows[row], column] = widget.number_of(value)
+        self.factory.edited()
+        if self.shown_widgets is not None and self.shown_widgets[0] == row:
+            self.shown_widgets = None
+    def setting_numbers(self, row, kind):
+        return self.tables[kind.__name__][self.setting_rows[row]] if self.setting_rows[row] >= 0 else np.zeros(0)
+    def widgets(self, row, kind):
+        # widgets for a component's settings, made when they're wanted and writing straight back to the table
+        if self.shown_widgets is None or self.shown_widgets[0] != row:
+            widgets = kind.make_settings()
+            for column, widget in enumerate(widgets.values()):
+                widget.from_number(self.tables[kind.__name__][self.setting_rows[row], column])
+                widget.changed = lambda number, column=column: self.set_number(row, kind, column, number)
+            self.shown_widgets = (row, widgets)
+        return self.shown_widgets[1]
+    def set_number(self, row, kind, column, number):
+        if self.kinds[row] == COMPONENT_KINDS.index(kind): # it might've been removed while being shown
+            self.tables[kind.__name__][self.setting_rows[row], column] = number
+            self.factory.edited()
+    def get_state(self):
+        # the stored attributes, by location rather than row
+        return {name: {tuple(self.locations[row].tolist()): value for row, value in values.items()}
+                for name, values in self.attributes.items() if len(values) > 0}
+    def set_state(self, state):
+        self.grid.load_all()
+        self.attributes = defaultdict(dict)
+        for name, values in state.items():
+            for location, value in values.items():
+                row = self.grid.get(location)
+                if row >= 0:
+                    self.attributes[name][row] = value
+
+class SteadyState:
+    # spots when a factory has settled into a loop, so the loop's steps can be replayed instead of simulated.
+    # after each step the state is boiled down to a key, and when a key comes round again the steps since then
+    # are probably a loop. the next time round is recorded (each step's output and the state after it), and if
+    # that ends exactly where it started, every step from then on is the recorded ones over and over, since the
+    # same state always leads to the same step. that's only true while nothing is random, so factories with
+    # noise oscillators are left alone, and while nothing's edited, so any edit clears it. the recorded states
+    # keep their chunks' audio alive, so loops longer than max_period steps or holding more than max_bytes
+    # aren't replayed.
+    ignored = ['characteristic_colour', 'sprite_name', 'stretched'] # stored attributes that don't change what happens next
+    def __init__(self, max_period=64, max_bytes=256 * 2**20):
+        self.max_period = max_period
+        self.max_bytes = max_bytes
+        self.clear()
+    def clear(self):
+        self.keys = OrderedDict() # key: step it was seen after, for the last max_period steps
+        self.steps = 0
+        self.digests = {} # id(signal): (signal, digest) for the signals in the last key
+        self.random = None # whether the factory has any noise oscillators, worked out when first needed
+        self.forget_loop()
+    def forget_loop(self):
+        self.start = None # state the loop starts from, once one's being recorded
+        self.period = None
+        self.recorded = [] # (output, state after) for each step of the loop so far
+        self.recorded_signals = set() # ids of the signals in it, to count what it's keeping alive
+        self.recorded_bytes = 0
+        self.phase = None # which step of the loop is next, while replaying
+    def looping(self):
+        return self.period is not None and len(self.recorded) == self.period
+    def moved(self):
+        # the factory's state was replaced, so where it's up to in the loop has to be worked out again
+        if self.looping():
+            self.phase = None
+        else:
+            self.forget_loop()
+    def replay(self, factory):
+        # the next step's output as (output,) if it can be replayed, in which case the factory is left in the
+        # state after it, or None if it has to be simulated
+        if not self.looping():
+            return None
+        if self.phase is None:
+            state = factory.get_state()
+            states = [self.start] + [after for output, after in self.recorded[:-1]]
+            self.phase = next((phase for phase, loop_state in enumerate(states) if SteadyState.same(state, loop_state)), None)
+            if self.phase is None: # not in the loop any more
+                self.forget_loop()
+                return None
+        phase = self.phase
+        output, state = self.recorded[phase]
+        factory.set_state(state)
+        now = time.monotonic()
+        for chunk in factory.soundchunks.values():
+            if chunk.location != chunk.previous_location: # so they're animated as moving this step
+                chunk.moved_at = now
+        self.phase = (phase + 1) % self.period
+        return (output,)
+    def stepped(self, factory, output):
+        # after a step's been simulated
+        if self.random is None:
+            self.random = SteadyState.has_noise(factory)
+        if self.random:
+            return
+        self.steps += 1
+        if self.period is not None:
+            state = factory.get_state()
+            self.recorded.append((output, state))
+            signals = [output] if output is not None else []
+            signals += [chunk.signal for chunk in state[0].values()]
+            signals += [chunk.signal for chunk in state[1].get('stored_chunk', {}).values()]
+            for signal in signals:
+                if id(signal) not in self.recorded_signals:
+                    self.recorded_signals.add(id(signal))
+                    self.recorded_bytes += signal.nbytes
+            if self.recorded_bytes > self.max_bytes:
+                self.forget_loop()
+            elif len(self.recorded) == self.period:
+                if SteadyState.same(state, self.start):
+                    self.phase = 0
+                else: # the keys matched but the states didn't
+                    self.forget_loop()
+            return
+        key = self.key(factory)
+        if key in self.keys:
+            self.period = self.steps - self.keys[key]
+            self.start = factory.get_state()
+        self.keys[key] = self.steps
+        self.keys.move_to_end(key)
+        while len(self.keys) > self.max_period:
+            self.keys.popitem(last=False)
+    def key(self, factory):
+        # a hash of everything that decides what happens next: where the chunks are and what's in them, and the
+        # components' stored chunks, gates, ticks and playheads. signals are only digested from a sample of them, which is
+        # enough to tell most apart; states with the same key are compared properly before anything's replayed
+        digests = {}
+        def digest(signal):
+            entry = self.digests.get(id(signal))
+            if entry is None or entry[0] is not signal:
+                entry = (signal, (len(signal), zlib.crc32(np.ascontiguousarray(signal[::97]))))
+            digests[id(signal)] = entry
+            return entry[1]
+        attributes = factory.components.attributes
+        key = hash((tuple(sorted((location, digest(chunk.signal)) for location, chunk in factory.soundchunks.items())),
+                    tuple(sorted((row, digest(chunk.signal)) for row, chunk in attributes['stored_chunk'].items())),
+                    tuple(sorted(attributes['opengates'].items())),
+                    tuple(sorted(attributes['tick'].items())),
+                    tuple(sorted(attributes['playhead'].items()))))
+        self.digests = digests
+        return key
+    def same(state, other):
+        # whether two states from FactoryFloor.get_state lead to the same steps
+        chunks, components = state
+        other_chunks, other_components = other
+        if chunks.keys() != other_chunks.keys():
+            return False
+        if not all(SteadyState.same_signal(chunk.signal, other_chunks[location].signal) for location, chunk in chunks.items()):
+            return False
+        for name in (components.keys() | other_components.keys()) - set(SteadyState.ignored):
+            values, other_values = components.get(name, {}), other_components.get(name, {})
+            if values.keys() != other_values.keys():
+                return False
+            for location, value in values.items():
+                if name == 'stored_chunk':
+                    if not SteadyState.same_signal(value.signal, other_values[location].signal):
+                        return False
+                elif value != other_values[location]:
+                    return False
+        return True
+    def same_signal(signal, other):
+        return signal is other or (len(signal) == len(other) and np.array_equal(signal, other))
+    def has_noise(factory):
+        store = factory.components
+        if 'Oscillator' not in store.tables:
+            return False
+        rows = np.flatnonzero(store.kinds[:store.rows] == COMPONENT_KINDS.index(Oscillator))
+        column, widget = kind_settings(Oscillator)[0]['waveform']
+        return bool(np.any(store.tables['Oscillator'][store.setting_rows[rows], column] == widget.number_of('noise')))
+
+class Timeline:
+    # snapshots of a factory's state taken every so many steps as it runs, so it can be put back how it was
+    # after any step (see FactoryFloor.seek) by restoring the snapshot before it and stepping on from there
+    # without playing anything. snapshots hold the state a region at a time, and a region that's the same as
+    # in the snapshot before is shared with it rather than copied, so a big factory with only a little going
+    # on costs little more than that little per snapshot. past max_snapshots every other one is dropped and
+    # they're taken half as often from then on. the layout isn't in them, so any edit clears them. neither
+    # are regions written out to disk, so a factory streaming its regions (see stream_regions) can't have one.
+    def __init__(self, every=50, max_snapshots=200):
+        self.every = every
+        self.max_snapshots = max_snapshots
+        self.furthest = 0 # the most steps the factory's been seen to have taken
+        self.clear()
+    def clear(self):
+        self.snapshots = {} # steps taken: ({region: (key, chunks, stored attributes)}, noise generator's state)
+    def record(self, factory):
+        # takes a snapshot of the factory as it is, if there isn't one from the last every steps
+        if factory.region_store is not None:
+            raise Exception('a factory streaming its regions to disk can\'t have a timeline')
+        steps = factory.steps_taken
+        self.furthest = max(self.furthest, steps)
+        earlier = [step for step in self.snapshots if step <= steps]
+        if len(earlier) > 0 and steps - max(earlier) < self.every:
+            return
+        previous = self.snapshots[max(earlier)][0] if len(earlier) > 0 else {}
+        # what's in each region, with chunks and arrays by identity since their signals never change in
+        # place, to tell which are the same as before without comparing any audio. the snapshot keeps them
+        # alive, so their ids can't be reused by something else while it's around to be compared with
+        keys = defaultdict(dict)
+        values = defaultdict(dict)
+        for location, chunk in factory.soundchunks.items():
+            region = SparseGrid.region_of(location)
+            keys[region][(None, location)] = (id(chunk.signal), chunk.colour, chunk.velocity)
+            values[region][(None, location)] = chunk
+        store = factory.components
+        for name, attribute in store.attributes.items():
+            for row, value in attribute.items():
+                location = tuple(store.locations[row].tolist())
+                region = SparseGrid.region_of(location)
+                if isinstance(value, SoundChunk):
+                    keys[region][(name, location)] = (id(value.signal), value.colour)
+                elif isinstance(value, np.ndarray):
+                    keys[region][(name, location)] = id(value)
+                else:
+                    keys[region][(name, location)] = value
+                values[region][(name, location)] = value
+        regions = {}
+        for region, key in keys.items():
+            if region in previous and previous[region][0] == key:
+                regions[region] = previous[region]
+                continue
+            chunks = {}
+            attributes = defaultdict(dict)
+            for (name, location), value in values[region].items():
+                if name is None:
+                    chunks[location] = value.copy()
+                else:
+                    attributes[name][location] = value.copy() if isinstance(value, SoundChunk) else value
+            regions[region] = (key, chunks, dict(attributes))
+        self.snapshots[steps] = (regions, DSP.rng.bit_generator.state)
+        if len(self.snapshots) > self.max_snapshots:
+            self.snapshots = {step: self.snapshots[step] for step in sorted(self.snapshots)[::2]}
+            self.every *= 2
+    def restore(self, factory, steps):
+        regions, noise = self.snapshots[steps]
+        chunks = {}
+        attributes = defaultdict(dict)
+        for key, region_chunks, region_attributes in regions.values():
+            chunks.update(region_chunks)
+            for name, values in region_attributes.items():
+                attributes[name].update({location: value.copy() if isinstance(value, SoundChunk) else value
+                                         for location, value in values.items()})
+        factory.set_state((chunks, attributes))
+        DSP.rng.bit_generator.state = noise
+        factory.steps_taken = steps
+    def seek(self, factory, steps):
+        # puts the factory in the state it was in after steps steps, going from the latest snapshot before
+        # then unless carrying on from where it is now is quicker. returns how many steps it simulated
+        earlier = [step for step in self.snapshots if step <= steps]
+        if factory.steps_taken > steps or (len(earlier) > 0 and max(earlier) > factory.steps_taken):
+            if len(earlier) == 0:
+                raise Exception(f'there\'s no snapshot from before step {steps}')
+            self.restore(factory, max(earlier))
+        simulated = steps - factory.steps_taken
+        while factory.steps_taken < steps:
+            factory.step()
+        return simulated
+
+class Transit:
+    # the conveyors compiled into tables, so stepping doesn't have to operate them one at a time or work out
+    # each block's move along them from scratch (see FactoryFloor.move_chunks). a block on a conveyor always
+    # goes the way it faces, and a conveyor always takes a block in, so a hop from one conveyor onto another
+    # only depends on the layout; every other move still gets worked out the long way. blocks are still moved
+    # a tile a step, in the same order as before, so the factory does exactly what it would have otherwise.
+    # the tables are made a region at a time, and editing a tile only throws away the regions it and its
+    # neighbours are in.
+    def __init__(self):
+        self.directions = {} # location: direction of the conveyor there
+        self.hops = {} # location: where a block on the conveyor there moves to, if that's another conveyor
+        self.compiled = {} # region: locations of the conveyors in it
+        self.stale = None # regions that need compiling again, or None for all of them
+    def edited(self, location=None):
+        # something at location changed, or anything anywhere if it's None
+        if location is None:
+            self.__init__()
+            return
+        x, y = location
+        for neighbour in [(x,y), (x,y-1), (x+1,y), (x,y+1), (x-1,y)]:
+            region = SparseGrid.region_of(neighbour)
+            for conveyor in self.compiled.pop(region, []):
+                self.directions.pop(conveyor, None)
+                self.hops.pop(conveyor, None)
+            if self.stale is not None:
+                self.stale.add(region)
+    def update(self, factory):
+        # compiles the regions that need it. ones written out to disk wait until they're back in memory
+        grid = factory.components.grid
+        if self.stale is None:
+            self.stale = set(grid.regions) | set(grid.spilled)
+        for region in [region for region in self.stale if region not in grid.spilled]:
+            self.compile_region(factory.components, region)
+            self.stale.discard(region)
+    def compile_region(self, store, region):
+        size = SparseGrid.region_size
+        rows = store.grid.regions.get(region)
+        self.compiled[region] = []
+        if rows is None:
+            return
+        ys, xs = np.nonzero(rows >= 0)
+        rows = rows[ys, xs]
+        conveyor = COMPONENT_KINDS.index(Conveyor)
+        is_conveyor = store.kinds[rows] == conveyor
+        gates = store.attributes['opengates']
+        for x, y, row in zip(xs[is_conveyor].tolist(), ys[is_conveyor].tolist(), rows[is_conveyor].tolist()):
+            location = ((region[0] * size) + x, (region[1] * size) + y)
+            direction = DIRECTIONS[store.directions.item(row)]
+            self.compiled[region].append(location)
+            self.directions[location] = direction
+            target = (location[0] + direction[0], location[1] + direction[1])
+            target_rows = store.grid.regions.get(SparseGrid.region_of(target)) # not read back in from disk for this
+            if target_rows is not None:
+                target_row = target_rows.item(target[1] % size, target[0] % size)
+                if target_row >= 0 and store.kinds.item(target_row) == conveyor and gates.get(target_row, True):
+                    self.hops[location] = target
+
+class FloorMap:
+    # a picture of each region of the floor with a pixel per tile, in the map_colour of the component there or
+    # the colour of the chunk on it. zoomed out below detail_scale the floor is drawn from these instead of a
+    # sprite per tile and a square per chunk, and FactoryUI's minimap is made from them too. a region's picture
+    # is only made again when something in it changes: edits say where they were (see
+    # FactoryFloor.layout_changed), and the chunks in each region are compared with last time whenever
+    # they're drawn.
+    detail_scale = 20 # viewscales below this are drawn from the map
+    background = (200,200,200)
+    spilled_colour = (90,90,90) # for components in regions that are written out to disk, whose kinds aren't to hand
+    def __init__(self):
+        self.components = {} # region: size x size x 3 uint8 array of the components' colours
+        self.chunks = {} # region: (locations, colours) of the chunks there as bytes, when its picture was made
+        self.pictures = {} # region: the components' colours with the chunks' on top
+        self.surfaces = {} # region: (viewscale, picture as a surface that size), for the regions last drawn
+        self.thumbnails = {} # region: (pixels across, picture shrunk to that)
+        self.stale = None # regions whose components' colours need working out again, or None for all of them
+        self.version = 0 # goes up whenever a picture changes
+        self.chunks_seen = (None, None) # (soundchunks, factory's changes) when the chunks were last looked at
+        self.minimap_key = None
+        self.minimap_picture = None
+    def edited(self, location=None):
+        # something at location changed, or anything anywhere if it's None
+        if location is None:
+            self.stale = None
+        elif self.stale is not None:
+            self.stale.add(SparseGrid.region_of(location))
+    def kind_colours():
+        return np.array([kind.map_colour for kind in COMPONENT_KINDS] + [FloorMap.background], dtype=np.uint8)
+    def update(self, factory, soundchunks):
+        store = factory.components
+        size = SparseGrid.region_size
+        changed = set()
+        grid = store.grid
+        if self.stale is None:
+            self.stale = set(grid.regions) | set(grid.spilled) | set(self.components)
+        colours = FloorMap.kind_colours()
+        for region in self.stale:
+            changed.add(region)
+            if region in grid.regions:
+                rows = grid.regions[region]
+                kinds = np.where(rows >= 0, store.kinds[rows], len(colours) - 1)
+                self.components[region] = colours[kinds]
+            elif region in grid.spilled:
+                occupancy = grid.spilled[region][0]
+                self.components[region] = np.where(occupancy[...,None], FloorMap.spilled_colour, FloorMap.background).astype(np.uint8)
+            else:
+                self.components.pop(region, None)
+        self.stale = set()
+        if self.chunks_seen[0] is soundchunks and self.chunks_seen[1] == factory.changes:
+            chunks = self.chunks
+        else:
+            chunks = FloorMap.chunk_regions(soundchunks)
+            self.chunks_seen = (soundchunks, factory.changes)
+        for region in chunks.keys() | self.chunks.keys():
+            if chunks.get(region) != self.chunks.get(region):
+                changed.add(region)
+        self.chunks = chunks
+        for region in changed:
+            self.surfaces.pop(region, None)
+            self.thumbnails.pop(region, None)
+            if region not in self.components and region not in chunks:
+                self.pictures.pop(region, None)
+                continue
+            picture = self.components[region].copy() if region in self.components else np.full((size, size, 3), FloorMap.background, dtype=np.uint8)
+            if region in chunks:
+                locations = np.frombuffer(chunks[region][0], dtype=np.int64).reshape(-1, 2) % size
+                picture[locations[:,1], locations[:,0]] = np.frombuffer(chunks[region][1], dtype=np.uint8).reshape(-1, 3)
+            self.pictures[region] = picture
+        if len(changed) > 0:
+            self.version += 1
+    def chunk_regions(soundchunks):
+        # the chunks' locations and colours as bytes by region, sorted by location so the same chunks in the
+        # same places compare equal
+        size = SparseGrid.region_size
+        chunks = {}
+        if len(soundchunks) > 0:
+            locations = np.array(list(soundchunks), dtype=np.int64)
+            chunk_colours = np.array([chunk.colour for chunk in soundchunks.values()]).astype(np.uint8)
+            regions = locations // size
+            order = np.lexsort((locations[:,1], locations[:,0], regions[:,1], regions[:,0]))
+            locations, chunk_colours, regions = locations[order], chunk_colours[order], regions[order]
+            starts = np.flatnonzero(np.any(regions[1:] != regions[:-1], axis=1)) + 1
+            for start, end in zip([0] + starts.tolist(), starts.tolist() + [len(locations)]):
+                chunks[tuple(regions[start].tolist())] = (locations[start:end].tobytes(), chunk_colours[start:end].tobytes())
+        return chunks
+    def surface(self, region, viewscale):
+        if region not in self.surfaces or self.surfaces[region][0] != viewscale:
+            size = SparseGrid.region_size
+            picture = pg.image.frombuffer(self.pictures[region].tobytes(), (size, size), 'RGB')
+            self.surfaces[region] = (viewscale, pg.transform.scale(picture, (size * viewscale, size * viewscale)))
+        return self.surfaces[region][1]
+    def minimap(self, view, max_size):
+        # a picture of everything on the floor and the area in view (left, top, right, bottom in tiles) no
+        # bigger than max_size pixels across, as (surface, tile at its top left, pixels per tile). each region
+        # is shrunk to a power of two pixels across by averaging, and kept until its picture changes
+        size = SparseGrid.region_size
+        regions = list(self.pictures)
+        left = min([region[0] for region in regions] + [view[0] // size])
+        top = min([region[1] for region in regions] + [view[1] // size])
+        right = max([region[0] for region in regions] + [(view[2] - 1) // size]) + 1
+        bottom = max([region[1] for region in regions] + [(view[3] - 1) // size]) + 1
+        across = 1
+        while across < size and (across * 2) * max(right - left, bottom - top) <= max_size:
+            across *= 2
+        key = (self.version, left, top, right, bottom, across)
+        if key != self.minimap_key:
+            picture = np.full(((bottom - top) * across, (right - left) * across, 3), FloorMap.background, dtype=np.uint8)
+            for region in regions:
+                if region not in self.thumbnails or self.thumbnails[region][0] != across:
+                    blocks = self.pictures[region].reshape(across, size // across, across, size // across, 3)
+                    self.thumbnails[region] = (across, blocks.mean(axis=(1,3)).astype(np.uint8))
+                x, y = (region[0] - left) * across, (region[1] - top) * across
+                picture[y:y + across, x:x + across] = self.thumbnails[region][1]
+            surface = pg.image.frombuffer(picture.tobytes(), (picture.shape[1], picture.shape[0]), 'RGB')
+            scale = across / size
+            if max(surface.get_size()) > max_size: # more regions than fit even at a pixel each
+                shrink = max_size / max(surface.get_size())
+                surface = pg.transform.smoothscale(surface, (max(1, int(surface.get_width() * shrink)), max(1, int(surface.get_height() * shrink))))
+                scale *= shrink
+            self.minimap_key = key
+            self.minimap_picture = (surface, (left * size, top * size), scale)
+        return self.minimap_picture
+
 class FactoryFloor:
     def __init__(self):
-        self.components = {}
+        self.components = ComponentStore(self)
         self.soundchunks = {}
         self.chunk_length = 1 # length in seconds of a chunk
         self.viewscale = 50
         self.viewlocation = [0,0]
-        self.outputs_this_step = []
-        self.settings = {'bpm': SliderSetting('bpm', (10,50), 0, 200)}
-        self.settings['bpm'].set_value(60)
+        self.outputs_this_step = [] # (location, signal) for each block that reached an output this step
+        self.settings = FactoryFloor.make_settings()
+        self.mixer = Mixer()
+        self.busy = set() # locations of components that need operating even when there's no chunk on them
+        self.next_order = 0 # components are operated in the order they were created
+        self.steady_state = SteadyState() # or None to simulate every step, even once it's settled into a loop
+        self.transit = Transit() # or None to operate and move everything one at a time
+        self.floor_map = FloorMap()
+        self.prepared_jobs = {} # results of this step's jobs that have already been worked out, by location
+    # drawing caches, see draw(). these are surfaces so they're left out when pickling
+    layout_version = 0 # goes up whenever something changes how the components look
+    changes = 0 # goes up every step and edit, so FloorMap can tell when the chunks can't have changed
+    steps_taken = 0 # since it was made or loaded, or whatever step it was last put back to, see seek
+    timeline = None # a Timeline, to be able to seek back to earlier steps
+    layers = None
+    layers_key = None
+    drawn_chunks = None
+    profiler = None # a Profiler, when the factory's being profiled
+    parallel = None # a ParallelDSP, when the factory's DSP is spread over several processes
+    region_store = None # directory that idle regions of components are written out to, see stream_regions
+    max_regions = None # how many regions of components to keep in memory when streaming them
+    @staticmethod
+    def make_settings():
+        settings = {'bpm': SliderSetting('bpm', (10,50), 0, 200),
+                    'gain': SliderSetting('gain', (250,50), 0, 2),
+                    'stereo width': SliderSetting('stereo width', (380,50), 0, 1),
+                    'limiter': MultipleChoiceSetting('limiter', (550,50), ['off', 'soft'])}
+        settings['bpm'].set_value(60)
+        settings['gain'].set_value(1)
+        settings['stereo width'].set_value(0)
+        return settings
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for cache in ['layers', 'layers_key', 'drawn_chunks', 'profiler', 'parallel', 'prepared_jobs', 'region_store', 'max_regions', 'steady_state', 'transit', 'floor_map', 'timeline']:
+            state.pop(cache, None)
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.steady_state = SteadyState()
+        self.transit = Transit()
+        self.floor_map = FloorMap()
+        self.prepared_jobs = {}
+        for name, setting in FactoryFloor.make_settings().items(): # older versions had fewer settings
+            self.settings.setdefault(name, setting)
+        if not hasattr(self, 'mixer'):
+            self.mixer = Mixer()
+            self.mixer.configure(self.settings)
+        if isinstance(self.components, dict): # pickled by an older version, when components were objects of their own
+            legacy = self.components
+            self.components = ComponentStore(self)
+            if not hasattr(self, 'next_order'): # and from before they kept track of their order
+                self.next_order = len(legacy)
+                for order, component in enumerate(legacy.values()):
+                    component.order = order
+            for location, component in legacy.items():
+                component.move_into(self, location)
+    def layout_changed(self, location=None):
+        # location is where the change was, if it was only one tile
+        self.layout_version += 1
+        if self.transit is not None:
+            self.transit.edited(location)
+        self.floor_map.edited(location)
+        self.edited()
+    def edited(self):
+        # anything that changes what the factory does, as opposed to it running, has to call this
+        self.changes += 1
+        if self.steady_state is not None:
+            self.steady_state.clear()
+        if self.timeline is not None:
+            self.timeline.clear()
     def create_component(self, kind, location, direction):
-        self.components[location] = kind(self, location, direction)
+        component = self.components.add(kind, location, direction, self.next_order)
+        component.created()
+        self.next_order += 1
+        self.busy.discard(location)
+        if component.is_busy():
+            self.busy.add(location)
+        self.layout_changed(location)
+    def find_busy(self):
+        # works out the busy set from scratch, for after the state has been replaced wholesale. only kinds that
+        # can be busy are looked at, and regions written out to disk never have anything busy in them (see
+        # evict_regions) so they aren't either. kinds that are always busy don't need looking at one by one
+        always = [kind for kind in COMPONENT_KINDS if kind.always_operates and kind.is_busy is FactoryComponent.is_busy]
+        kinds = [kind for kind in COMPONENT_KINDS if kind.is_busy is not FactoryComponent.is_busy]
+        store = self.components
+        rows = np.flatnonzero(np.isin(store.kinds[:store.rows], [COMPONENT_KINDS.index(kind) for kind in always]))
+        self.busy = set(zip(*store.locations[rows].T.tolist()))
+        self.busy.update(component.location for component in store.of_kinds(kinds) if component.is_busy())
+    def stream_regions(self, directory, max_regions):
+        # keep at most max_regions regions of components in memory (as long as enough of them are idle),
+        # writing the rest to files in directory and reading them back when a chunk reaches them. for
+        # rendering factories too big to fit in memory; it doesn't help while the editor is keeping snapshots
+        # of the state, since taking one reads everything back in.
+        self.region_store = directory
+        self.max_regions = max_regions
+        self.timeline = None # snapshots don't include spilled regions
+        self.steady_state = None # putting a recorded state back would need every region in memory
+        self.components.grid.loader = self.load_region
+        self.evict_regions()
+    def evict_regions(self):
+        # regions are written out oldest first, skipping any with a chunk or something busy or holding a
+        # chunk in them, since those would only be read straight back in
+        resident = self.components.grid.resident_regions()
+        if len(resident) <= self.max_regions:
+            return
+        in_use = {SparseGrid.region_of(location) for location in self.soundchunks}
+        in_use.update(SparseGrid.region_of(location) for location in self.busy)
+        for region in list(resident):
+            if len(resident) <= self.max_regions:
+                break
+            if region in in_use:
+                continue
+            rows = self.components.region_rows(region)
+            if any(row in self.components.attributes['stored_chunk'] for row in rows.tolist()):
+                continue
+            filename = os.path.join(self.region_store, f'{region[0]}_{region[1]}.region')
+            with open(filename, 'wb') as file:
+                write_region(file, self.components, rows)
+            self.components.spill_region(region, filename)
+            resident.remove(region)
+    def load_region(self, region, filename):
+        with open(filename, 'rb') as file:
+            read_region(file, self)
     def create_soundchunk(self, signal, location):
         self.soundchunks[location] = SoundChunk(self, location, signal)
     def floorlocation_to_screenlocation(self, position):
         return ((position[0]-self.viewlocation[0])*self.viewscale, (position[1]-self.viewlocation[1])*self.viewscale)
     def screenlocation_to_floorlocation(self, position):
         return ((position[0]//self.viewscale) + self.viewlocation[0], (position[1]//self.viewscale) + self.viewlocation[1])
-    def draw(self, screen):
+    def visible_locations(self, items, screen_size):
+        # locations in items (a dict keyed by location) that are on screen, looking up whichever of the
+        # visible cells or the items there are fewer of, or asking a ComponentStore's grid
+        w,h = screen_size
+        columns = range(self.viewlocation[0], self.viewlocation[0] + math.ceil(w/self.viewscale))
+        rows = range(self.viewlocation[1], self.viewlocation[1] + math.ceil(h/self.viewscale))
+        if isinstance(items, ComponentStore):
+            return items.grid.locations_in(columns.start, rows.start, columns.stop, rows.stop)
+        if len(columns) * len(rows) < len(items):
+            return [(x,y) for x in columns for y in rows if (x,y) in items]
+        return [location for location in items if location[0] in columns and location[1] in rows]
+    def build_layers(self, screen):
+        # the components are drawn once onto two layers that are reused until they change or the view moves:
+        # one under the chunks (the background and open topped components like conveyors) and one over them
         w,h = screen.get_size()
-        pg.draw.rect(screen, (200,200,200), (0,0,w,h))
-        for x in range(math.ceil(w/self.viewscale)):
-            for y in range(math.ceil(h/self.viewscale)):
-                x_off = x + self.viewlocation[0]
-                y_off = y + self.viewlocation[1]
-                if (x_off,y_off) in self.components and self.components[(x_off,y_off)].opentop:
-                    self.components[(x_off,y_off)].draw(screen)
-        for x in range(math.ceil(w/self.viewscale)):
-            for y in range(math.ceil(h/self.viewscale)):
-                x_off = x + self.viewlocation[0]
-                y_off = y + self.viewlocation[1]
-                if (x_off,y_off) in self.soundchunks:
-                    self.soundchunks[(x_off,y_off)].draw(screen)
-        for x in range(math.ceil(w/self.viewscale)):
-            for y in range(math.ceil(h/self.viewscale)):
-                x_off = x + self.viewlocation[0]
-                y_off = y + self.viewlocation[1]
-                if (x_off,y_off) in self.components and not self.components[(x_off,y_off)].opentop:
-                    self.components[(x_off,y_off)].draw(screen)
+        Sprites.set_viewscale(self.viewscale)
+        below = pg.Surface((w,h)).convert()
+        below.fill((200,200,200))
+        above = pg.Surface((w,h), pg.SRCALPHA).convert_alpha()
+        above.fill((0,0,0,0))
+        for location in self.visible_locations(self.components, (w,h)):
+            component = self.components[location]
+            component.draw(below if component.opentop else above)
+        self.layers = (below, above)
+    def draw_map(self, screen, soundchunks):
+        # the floor zoomed out, as a picture of each region from floor_map rather than anything per tile
+        self.floor_map.update(self, soundchunks)
+        key = ('map', self.floor_map.version, self.viewscale, tuple(self.viewlocation), screen.get_size())
+        if self.layers_key == key and self.drawn_chunks is not None:
+            return []
+        w,h = screen.get_size()
+        size = SparseGrid.region_size
+        screen.fill(FloorMap.background)
+        drawn = {}
+        for ry in range(self.viewlocation[1] // size, (self.viewlocation[1] + math.ceil(h/self.viewscale) - 1) // size + 1):
+            for rx in range(self.viewlocation[0] // size, (self.viewlocation[0] + math.ceil(w/self.viewscale) - 1) // size + 1):
+                if (rx,ry) in self.floor_map.pictures:
+                    screen.blit(self.floor_map.surface((rx,ry), self.viewscale), self.floorlocation_to_screenlocation((rx * size, ry * size)))
+                    drawn[(rx,ry)] = self.floor_map.surfaces[(rx,ry)]
+        self.floor_map.surfaces = drawn # only the ones on screen are worth keeping
+        self.layers_key = key
+        self.drawn_chunks = set()
+        return None
+    def draw(self, screen, soundchunks=None):
+        # soundchunks can be given to draw chunks from a snapshot rather than the current state.
+        # returns the list of rects on the screen that changed, or None if all of it did.
+        started = time.perf_counter()
+        if soundchunks is None:
+            soundchunks = self.soundchunks
+        if self.viewscale < FloorMap.detail_scale:
+            dirty = self.draw_map(screen, soundchunks)
+            if self.profiler is not None:
+                self.profiler.record_draw(started, time.perf_counter() - started)
+            return dirty
+        key = (self.layout_version, self.viewscale, tuple(self.viewlocation), screen.get_size())
+        full_redraw = self.layers_key != key or self.drawn_chunks is None
+        if self.layers_key != key:
+            self.build_layers(screen)
+            self.layers_key = key
+        below, above = self.layers
+        chunks = []
+        for location in self.visible_locations(soundchunks, screen.get_size()):
+            chunk = soundchunks[location]
+            chunks.append((chunk, chunk.draw_rect()))
+        # a chunk only needs drawing again if it's moved or changed colour, or something drawn where it was has
+        drawn = {(tuple(rect), chunk.colour) for chunk, rect in chunks}
+        if full_redraw:
+            dirty = None
+            screen.blit(below, (0,0))
+            for chunk, rect in chunks:
+                chunk.draw(screen, rect)
+            screen.blit(above, (0,0))
+        else:
+            dirty = [pg.Rect(rect) for rect, colour in drawn ^ self.drawn_chunks]
+            for area in dirty:
+                screen.blit(below, area, area)
+            for chunk, rect in chunks:
+                if rect.collidelist(dirty) != -1:
+                    chunk.draw(screen, rect)
+            for area in dirty:
+                screen.blit(above, area, area)
+        self.drawn_chunks = drawn
+        if self.profiler is not None:
+            self.profiler.record_draw(started, time.perf_counter() - started)
+        return dirty
+    def redraw_all(self):
+        # make the next draw() redraw the whole screen, eg. after something else has been drawn over it
+        self.drawn_chunks = None
     def step(self):
-        for component in self.components.values():
-            component.operate()
-        for soundchunk in list(self.soundchunks.values()):
-            soundchunk.move()
-        for soundchunk in self.soundchunks.values():
-            soundchunk.moved_this_tick = False
+        # returns the mix of everything that reached an output this step, or None if nothing did.
+        # only components with a chunk on them or something of their own to do (see FactoryComponent.is_busy)
+        # are operated, since the rest wouldn't do anything, so big layouts with few chunks are cheap. once
+        # it's settled into a loop, steps are replayed rather than simulated (see SteadyState).
+        if self.timeline is not None:
+            self.timeline.record(self)
+        self.steps_taken += 1
+        self.changes += 1
+        if self.steady_state is not None and (replayed := self.steady_state.replay(self)) is not None:
+            return replayed[0]
+        profiler = self.profiler
+        step_started = time.perf_counter()
+        transit = self.transit
+        if transit is None:
+            active = self.components.active(self.busy.union(self.soundchunks))
+        else:
+            # the blocks on conveyors are pointed the way they're going here, since that's all operating a
+            # conveyor does and it can't affect anything else
+            started = time.perf_counter()
+            transit.update(self)
+            directions = transit.directions
+            others = []
+            for location, chunk in self.soundchunks.items():
+                direction = directions.get(location)
+                if direction is None:
+                    others.append(location)
+                else:
+                    chunk.velocity = direction
+            if profiler is not None:
+                profiler.record_transit(started, time.perf_counter() - started, len(self.soundchunks) - len(others))
+            active = self.components.active(self.busy.union(others))
+        if self.parallel is not None:
+            started = time.perf_counter()
+            jobs = {component.location: job for component in active if (job := component.job()) is not None}
+            self.prepared_jobs = self.parallel.run(jobs)
+            if profiler is not None:
+                profiler.event('ParallelDSP.run', 'dsp', started, time.perf_counter() - started, {'jobs': len(jobs)})
+        else:
+            started = time.perf_counter()
+            jobs = {component.location: job[1] for component in active if type(component) is ADSR and (job := component.job()) is not None}
+            if len(jobs) > 1:
+                self.prepared_jobs = DSP.envelopes(jobs)
+                if profiler is not None:
+                    profiler.event('DSP.envelopes', 'dsp', started, time.perf_counter() - started, {'jobs': len(jobs)})
+        for component in active:
+            if profiler is None:
+                component.operate()
+            else:
+                started = time.perf_counter()
+                component.operate()
+                profiler.record_operate(component, started, time.perf_counter() - started)
+            if component.is_busy():
+                self.busy.add(component.location)
+            else:
+                self.busy.discard(component.location)
+        moves_started = time.perf_counter()
+        if transit is not None:
+            self.move_chunks(transit.hops)
+            if profiler is not None:
+                profiler.event('FactoryFloor.move_chunks', 'move', moves_started, time.perf_counter() - moves_started)
+        else:
+            moved = []
+            for soundchunk in [soundchunk for soundchunk in self.soundchunks.values() if soundchunk.velocity != Compass.STATIONARY]:
+                if profiler is None:
+                    soundchunk.move(moved)
+                else:
+                    started = time.perf_counter()
+                    location = soundchunk.location
+                    soundchunk.move(moved)
+                    profiler.record_move(location, started, time.perf_counter() - started)
+            for soundchunk in moved:
+                soundchunk.moved_this_tick = False
+        self.prepared_jobs = {}
+        if self.region_store is not None:
+            self.evict_regions()
+        mix_started = time.perf_counter()
+        final_output = None
         if len(self.outputs_this_step) > 0:
-            final_output = self.outputs_this_step[0]
-            if len(self.outputs_this_step) > 1:
-                for output in self.outputs_this_step[1:]:
-                    final_output += output
-            final_output.play()
+            final_output = self.mixer.mix(self, self.outputs_this_step)
             self.outputs_this_step = []
+        if profiler is not None:
+            profiler.record_step(step_started, moves_started - step_started, mix_started - moves_started,
+                                 time.perf_counter() - mix_started, len(self.soundchunks), self.chunk_length)
+        if self.steady_state is not None:
+            self.steady_state.stepped(self, final_output)
+        return final_output
+    def seek(self, steps):
+        # puts the factory back (or forward) to how it was after steps steps, see Timeline. returns how many
+        # steps it had to simulate to get there
+        return self.timeline.seek(self, steps)
+    def move_chunks(self, hops):
+        # SoundChunk.move for every chunk that's moving, in the same order, but all in one loop and with hops
+        # (see Transit) saying where the chunks on conveyors go without looking at what's there
+        chunks = self.soundchunks
+        accepts = self.components.accepts
+        now = time.monotonic()
+        moved = []
+        for first in [chunk for chunk in chunks.values() if chunk.velocity != Compass.STATIONARY]:
+            if first.moved_this_tick:
+                continue
+            stack = [(first, False)]
+            while len(stack) > 0:
+                chunk, resolving = stack.pop()
+                location = chunk.location
+                target = hops.get(location)
+                hop = target is not None
+                if not hop:
+                    target = (location[0]+chunk.velocity[0], location[1]+chunk.velocity[1])
+                if not resolving:
+                    if chunk.moved_this_tick:
+                        continue
+                    chunk.moved_this_tick = True
+                    moved.append(chunk)
+                    stack.append((chunk, True))
+                    if target in chunks:
+                        stack.append((chunks[target], False))
+                else:
+                    if target not in chunks and (hop or accepts(target)):
+                        chunk.moved_at = now
+                        chunk.previous_location = location
+                        del chunks[location]
+                        chunks[target] = chunk
+                        chunk.location = target
+                    chunk.velocity = Compass.STATIONARY
+        for chunk in moved:
+            chunk.moved_this_tick = False
     def move_soundchunk(self, location, direction):
         if location in self.soundchunks:
             chunk = self.soundchunks.pop(location)
@@ -136,53 +1669,135 @@ class FactoryFloor:
             self.soundchunks[new_location].location = new_location
     def remove_component(self, location):
         if location in self.components:
-            self.components.pop(location)
+            self.components.remove(location)
+            self.busy.discard(location)
+            self.layout_changed(location)
         if location in self.soundchunks:
             self.soundchunks.pop(location)
     def settings_changed(self):
-        self.chunk_length = 60/self.settings['bpm'].get_value()
+        bpm = self.settings['bpm'].get_value()
+        if bpm > 0: # at 0 bpm time stands still, so chunk_length keeps its last value but no steps get played
+            self.chunk_length = 60/bpm
+        self.mixer.configure(self.settings)
+        Oscillator.waveform_cache.clear()
+        ADSR.envelope_cache.clear()
+        self.edited()
+    def get_state(self):
+        # everything that changes as the factory runs (as opposed to being edited). signals are never
+        # modified in place so they can be shared, but chunks are, so they get copied.
+        return ({location: chunk.copy() for location, chunk in self.soundchunks.items()}, self.components.get_state())
+    def set_state(self, state):
+        soundchunks, component_state = state
+        self.soundchunks = {location: chunk.copy() for location, chunk in soundchunks.items()}
+        self.components.set_state(component_state)
+        self.outputs_this_step = []
+        self.find_busy()
+        if self.steady_state is not None:
+            self.steady_state.moved()
 
 
 class FactoryComponent:
+    # a view of one component's row in its factory's ComponentStore, made whenever the component is looked up,
+    # so anything that needs to last between steps goes in the store through a StoredAttribute
+    __slots__ = ('factory', 'location', 'row')
     name = "<component>"
     opentop = False
-    opengates = True
+    opengates = StoredAttribute(True)
     characteristic_colour = (255,255,255)
-    settings = {}
+    map_colour = (90,90,90) # colour of its tile when the floor's zoomed out, see FloorMap
     info = '[no information given]'
-    def __init__(self, factory, location, direction):
+    always_operates = False # whether operate() needs calling every step, even with no chunk here
+    def __init__(self, factory, location, row):
         self.factory = factory
         self.location = location
-        self.direction = direction
+        self.row = row
+    @staticmethod
+    def make_settings():
+        # the widgets for this kind's settings, at their defaults
+        return {}
+    @property
+    def direction(self):
+        return DIRECTIONS[self.factory.components.directions.item(self.row)]
+    @direction.setter
+    def direction(self, direction):
+        self.factory.components.directions[self.row] = DIRECTIONS.index(direction)
+    @property
+    def order(self):
+        return int(self.factory.components.orders[self.row])
+    @order.setter
+    def order(self, order):
+        self.factory.components.orders[self.row] = order
+    @property
+    def settings(self):
+        return self.factory.components.widgets(self.row, type(self))
+    def setting(self, name):
+        return self.factory.components.get_setting(self.row, type(self), name)
+    def set_setting(self, name, value):
+        self.factory.components.set_setting(self.row, type(self), name, value)
+    def setting_numbers(self):
+        return self.factory.components.setting_numbers(self.row, type(self))
+    def created(self):
+        # called once when the component is first put on the floor
+        pass
     def rotate(self):
         self.direction = Compass.rotated_clockwise(self.direction)
+        self.factory.layout_changed(self.location)
+    def is_busy(self):
+        # whether operate() has something to do next step even if no chunk arrives
+        return self.always_operates
+    def job(self):
+        # the expensive part of this step's operate(), as (name of a DSP function, its arguments), or None if
+        # there isn't one. it can only depend on the chunk here and this component's own state, since the
+        # factory may work it out before anything operates (see ParallelDSP)
+        return None
+    def run_job(self):
+        # the result of job(), for operate() to use, either worked out already or worked out now
+        if self.location in self.factory.prepared_jobs:
+            return self.factory.prepared_jobs.pop(self.location)
+        name, arguments = self.job()
+        return getattr(DSP, name)(*arguments)
     def stamp_colour(self, chunk):
         chunk.colour = ((chunk.colour[0]+self.characteristic_colour[0])/2,
                         (chunk.colour[1]+self.characteristic_colour[1])/2,
                         (chunk.colour[2]+self.characteristic_colour[2])/2)
     def settings_changed(self):
         pass
+    @staticmethod
+    def settings_loaded(store, rows):
+        # what settings_changed does, for many components of a kind at once as they're loaded, leaving out
+        # anything the loader does once for the whole factory afterwards
+        pass
     def draw(self, screen):
         location = self.factory.floorlocation_to_screenlocation(self.location)
-        sprite = Sprites.get_sprite('component', self.sprite_name)
-        if self.direction == Compass.NORTH:
-            screen.blit(pg.transform.scale(sprite, (self.factory.viewscale, self.factory.viewscale)), location)
-        elif self.direction == Compass.SOUTH:
-            screen.blit(pg.transform.scale(pg.transform.rotate(sprite, 180), (self.factory.viewscale, self.factory.viewscale)), location)
-        elif self.direction == Compass.EAST:
-            screen.blit(pg.transform.scale(pg.transform.rotate(sprite, 270), (self.factory.viewscale, self.factory.viewscale)), location)
-        elif self.direction == Compass.WEST:
-            screen.blit(pg.transform.scale(pg.transform.rotate(sprite, 90), (self.factory.viewscale, self.factory.viewscale)), location)
+        if self.direction in [Compass.NORTH, Compass.EAST, Compass.SOUTH, Compass.WEST]:
+            screen.blit(Sprites.get_transformed('component', self.sprite_name, self.direction, self.factory.viewscale), location)
         else:
             print(f'WARNING: factorycomponent with improper direction ({self.direction})')
 
 class SettingWidget:
-    rect = pg.Rect(0,0,0,0)
+    rect = None # created on first draw, so widgets can exist without pygame
+    location = (0,0)
     default = 0
+    changed = None # called with the new value as a number whenever it's set, see ComponentStore.widgets
+    def collidepoint(self, pos):
+        return self.rect is not None and self.rect.collidepoint(pos)
     def get_value(self):
         return self.value
     def set_value(self, new_v):
-        self.value = new_v
+        self.store_value(new_v)
+    def store_value(self, value):
+        self.value = value
+        if self.changed is not None:
+            self.changed(self.to_number())
+    def number_of(self, value):
+        # a value as a plain number, for saving and for ComponentStore's settings tables
+        return value
+    def value_of(self, number):
+        return float(number)
+    def to_number(self):
+        return self.number_of(self.value)
+    def from_number(self, number):
+        self.set_value(self.value_of(number))
     def mousedown(self, pos):
         pass
     def mouseup(self, pos):
@@ -194,12 +1809,18 @@ class MultipleChoiceSetting(SettingWidget):
     def __init__(self, name, location, options):
         self.options = options
         self.value = options[0]
-        self.rect = pg.Rect(*location, 0, 0)
+        self.location = location
         self.name = name
     def set_value(self, new_v):
         if new_v in self.options:
-            self.value = new_v
+            self.store_value(new_v)
+    def number_of(self, value):
+        return self.options.index(value)
+    def value_of(self, number):
+        return self.options[int(number)]
     def draw(self, screen, font):
+        if self.rect is None:
+            self.rect = pg.Rect(*self.location, 0, 0)
         if self.rect.w == 0:
             self.rect.w = max([Sprites.get_sprite('text', option).get_size()[0] for option in self.options])
             self.rect.h = sum([Sprites.get_sprite('text', option).get_size()[1] for option in self.options])
@@ -226,10 +1847,12 @@ class SliderSetting(SettingWidget):
         self.maximum = maximum
         self.range = maximum - minimum
         self.value = (minimum + maximum) / 2
-        self.rect = pg.Rect(*location, 0, 0)
+        self.location = location
         self.labels = None
         self.name = name
     def draw(self, screen, font):
+        if self.rect is None:
+            self.rect = pg.Rect(*self.location, 0, 0)
         if self.labels == None:
             self.labels = [str(round(self.minimum,1)),
                            str(round((self.minimum+self.maximum)/2,1)),
@@ -250,13 +1873,15 @@ class SliderSetting(SettingWidget):
     def mousedrag(self, pos):
         self.set_value(((1-((pos[1]-self.rect.y)/self.rect.h))*self.range) + self.minimum)
     def set_value(self, new_v):
-        self.value = max(self.minimum, min(self.maximum, new_v))
+        self.store_value(max(self.minimum, min(self.maximum, new_v)))
 
 
 class Conveyor(FactoryComponent):
+    __slots__ = ()
     name = 'conveyor belt'
     sprite_name = 'conveyor'
     opentop = True
+    map_colour = (150,150,150)
     info = 'moves any block on it in the direction it faces.'
     def operate(self):
         if self.location in self.factory.soundchunks:
@@ -264,93 +1889,185 @@ class Conveyor(FactoryComponent):
 
 
 class Oscillator(FactoryComponent):
+    __slots__ = ()
     name = 'oscillator'
-    sprite_name = 'sine_generator'
+    sprite_name = StoredAttribute('sine_generator')
     info = 'an oscillator generates a block of a plain tone whenever no other block is passing through it. different waveforms create different sounds.'
-    characteristic_colour = (0,0,255)
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.settings = {'waveform': MultipleChoiceSetting('waveform', (10,50), ['sine', 'square', 'sawtooth', 'triangle', 'noise', 'silence']),
-                         'frequency': MultipleChoiceSetting('note', (120, 50), ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']),
-                         'detune': SliderSetting('detune', (180,50), -20, 20)}
+    characteristic_colour = StoredAttribute((0,0,255))
+    map_colour = (0,0,255)
+    waveform_cache = WaveformCache(128) # shared by every oscillator
+    always_operates = True
+    looks = {'sine': ('sine_generator', (0,0,255)), # waveform: (sprite, characteristic colour)
+             'square': ('square_generator', (0,255,0)),
+             'sawtooth': ('sawtooth_generator', (255,0,0)),
+             'triangle': ('triangle_generator', (255,255,0)),
+             'noise': ('noise_generator', (180,180,180)),
+             'silence': ('silence_generator', (0,0,0))}
+    @staticmethod
+    def make_settings():
+        return {'waveform': MultipleChoiceSetting('waveform', (10,50), ['sine', 'square', 'sawtooth', 'triangle', 'noise', 'silence']),
+                'frequency': MultipleChoiceSetting('note', (120, 50), ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']),
+                'detune': SliderSetting('detune', (180,50), -20, 20)}
     def operate(self):
         if self.location not in self.factory.soundchunks:
-            generator = {'sine': gensound.Sine, 'square': gensound.Square,
-                         'sawtooth': gensound.Sawtooth, 'triangle': gensound.Triangle,
-                         'noise': gensound.WhiteNoise, 'silence': gensound.Silence}[self.settings['waveform'].get_value()]
-            if self.settings['waveform'].get_value() in ['noise', 'silence']: #  these ones choke on 'frequency' input
-                self.factory.create_soundchunk(generator(duration=1e3 * self.factory.chunk_length), self.location)
+            waveform = self.setting('waveform')
+            note = self.setting('frequency')
+            detune = self.setting('detune')
+            frequency = {'A':440, 'A#':466.2, 'B':493.9, 'C':523.3,
+                         'C#':554.4, 'D':587.3, 'D#':622.3, 'E':659.3,
+                         'F':698.5,'F#':740, 'G':784, 'G#':830.6}[note] + detune
+            length = DSP.samples(self.factory.chunk_length)
+            if waveform == 'noise': # every noise block should be different, so these aren't cached
+                signal = DSP.oscillator(waveform, frequency, length)
             else:
-                self.factory.create_soundchunk(generator(frequency={'A':440, 'A#':466.2, 'B':493.9, 'C':523.3,
-                                                                    'C#':554.4, 'D':587.3, 'D#':622.3, 'E':659.3,
-                                                                    'F':698.5,'F#':740, 'G':784, 'G#':830.6}[self.settings['frequency'].get_value()] +
-                                                         self.settings['detune'].get_value(), duration=1e3 * self.factory.chunk_length),
-                                               self.location)
+                signal = Oscillator.waveform_cache.get((waveform, note, detune, self.factory.chunk_length),
+                                                       lambda: DSP.oscillator(waveform, frequency, length))
+            self.factory.create_soundchunk(signal, self.location)
             self.stamp_colour(self.factory.soundchunks[self.location])
         self.factory.soundchunks[self.location].velocity = self.direction
     def settings_changed(self):
-        self.sprite_name, self.characteristic_colour = {'sine': ('sine_generator', (0,0,255)),
-                                                        'square': ('square_generator', (0,255,0)),
-                                                        'sawtooth': ('sawtooth_generator', (255,0,0)),
-                                                        'triangle': ('triangle_generator', (255,255,0)),
-                                                        'noise': ('noise_generator', (180,180,180)),
-                                                        'silence': ('silence_generator', (0,0,0))}[self.settings['waveform'].get_value()]
+        Oscillator.waveform_cache.clear()
+        self.factory.layout_changed(self.location)
+        self.sprite_name, self.characteristic_colour = Oscillator.looks[self.setting('waveform')]
+    @staticmethod
+    def settings_loaded(store, rows):
+        # only oscillators that aren't sines need their sprite and colour stored
+        column, widget = kind_settings(Oscillator)[0]['waveform']
+        waveforms = store.tables['Oscillator'][store.setting_rows[rows], column]
+        for number, waveform in enumerate(widget.options):
+            sprite_name, colour = Oscillator.looks[waveform]
+            selected = rows[waveforms == number].tolist()
+            if waveform != 'sine' and len(selected) > 0:
+                store.attributes['sprite_name'].update(dict.fromkeys(selected, sprite_name))
+                store.attributes['characteristic_colour'].update(dict.fromkeys(selected, colour))
+
+class SamplePlayer(FactoryComponent):
+    __slots__ = ()
+    name = 'sample player'
+    sprite_name = 'sample'
+    info = 'a sample player plays a wav file a block at a time, whenever no other block is passing through it. the file is read as it plays rather than loaded, so it can be as long as you like. the start point is how far into the file it starts (and loops back to), as a proportion of its length.'
+    characteristic_colour = (0,255,255)
+    map_colour = (0,255,255)
+    sample_file = StoredAttribute(None) # filename of the file to play
+    playhead = StoredAttribute(None) # where in the file (in its frames) the next block starts, or None for the start point
+    always_operates = True
+    @staticmethod
+    def make_settings():
+        settings = {'loop': MultipleChoiceSetting('loop', (10,50), ['on', 'off']),
+                    'start': SliderSetting('start point', (120,50), 0, 1)}
+        settings['start'].set_value(0)
+        return settings
+    def next_block(self):
+        # the next block of the file, or None if there isn't one. a block that reaches the end of the file
+        # carries on from the start point if it's looping, or is padded with silence if it isn't
+        sample = None if self.sample_file is None else SampleFile.open(self.sample_file)
+        if sample is None:
+            return None
+        start = min(int(self.setting('start') * sample.length), sample.length - 1)
+        position = start if self.playhead is None else self.playhead
+        if position >= sample.length:
+            return None
+        length = DSP.samples(self.factory.chunk_length)
+        step = sample.rate / SAMPLE_RATE
+        looping = self.setting('loop') == 'on'
+        pieces = []
+        needed = length
+        while needed > 0:
+            fits = min(needed, math.ceil((sample.length - position) / step))
+            pieces.append(sample.read(position, fits, step))
+            needed -= fits
+            position += fits * step
+            if position >= sample.length:
+                if not looping:
+                    pieces.append(np.zeros(needed, dtype=np.float32))
+                    break
+                position = start + ((position - sample.length) % (sample.length - start))
+        self.playhead = position
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+    def operate(self):
+        if self.location not in self.factory.soundchunks:
+            signal = self.next_block()
+            if signal is not None:
+                self.factory.create_soundchunk(signal, self.location)
+                self.stamp_colour(self.factory.soundchunks[self.location])
+        if self.location in self.factory.soundchunks:
+            self.factory.soundchunks[self.location].velocity = self.direction
+    def choose_file(self, filename):
+        SampleFile.mapped.pop(filename, None) # so a file that couldn't be opened before gets another go
+        self.sample_file = filename
+        self.playhead = None
+        self.factory.edited()
+    def settings_changed(self):
+        self.playhead = None
+        self.factory.edited()
 
 
 
 class ADSR(FactoryComponent):
+    __slots__ = ()
     name = 'ADSR envelope'
     sprite_name = 'adsr'
     info = 'applies an ADSR (attack, decay, sustain, release) envelope to each block that passes through it. attack is the time it takes to fade in to maximum volume, decay is the time it takes to fade out to the sustain level where it holds for a while, then release is the time it takes to fade out entirely. attack, decay and release are given as a proportion of the total time of the block, if they total more than 1 then the end of the envelope will be truncated'
     characteristic_colour = (255,0,255)
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.settings = {'attack': SliderSetting('attack time', (10,50), 0, 1),
-                         'decay': SliderSetting('decay time', (150,50), 0, 1),
-                         'sustain': SliderSetting('sustain level', (270,50), 0, 1),
-                         'release': SliderSetting('release time', (420,50), 0, 1)}
-        self.settings['attack'].set_value(0.2)
-        self.settings['decay'].set_value(0.2)
-        self.settings['sustain'].set_value(0.75)
-        self.settings['release'].set_value(0.2)
-    def operate(self):
-        if self.location in self.factory.soundchunks:
-            atk = math.floor(self.settings['attack'].get_value() * self.factory.chunk_length * 44100)
-            dec = math.floor(self.settings['decay'].get_value() * self.factory.chunk_length * 44100)
-            sus = self.settings['sustain'].get_value()
-            rel = math.floor(self.settings['release'].get_value() * self.factory.chunk_length * 44100)
-            if isinstance(self.factory.soundchunks[self.location].signal, gensound.signals.Mix):
-                chunk_length = math.floor((self.factory.soundchunks[self.location].signal.signals[0].duration/1000) * 44100)
+    map_colour = (255,0,255)
+    @staticmethod
+    def make_settings():
+        settings = {'attack': SliderSetting('attack time', (10,50), 0, 1),
+                    'decay': SliderSetting('decay time', (150,50), 0, 1),
+                    'sustain': SliderSetting('sustain level', (270,50), 0, 1),
+                    'release': SliderSetting('release time', (420,50), 0, 1)}
+        settings['attack'].set_value(0.2)
+        settings['decay'].set_value(0.2)
+        settings['sustain'].set_value(0.75)
+        settings['release'].set_value(0.2)
+        return settings
+    envelope_cache = WaveformCache(64) # envelopes by settings, chunk_length and block length, shared by every ADSR
+    def make_envelope(attack, decay, sustain, release, chunk_length, length):
+        atk = math.floor(attack * chunk_length * SAMPLE_RATE)
+        dec = math.floor(decay * chunk_length * SAMPLE_RATE)
+        rel = math.floor(release * chunk_length * SAMPLE_RATE)
+        if atk + dec + rel >= length:
+            difference = (atk + dec + rel - length) + 3 # three sample safety margin cus we can't have 0-length sections apparently
+            if difference < rel:
+                rel -= difference
             else:
-                chunk_length = math.floor((self.factory.soundchunks[self.location].signal.duration/1000) * 44100)
-            if atk + dec + rel >= chunk_length:
-                difference = (atk + dec + rel - chunk_length) + 3 # three sample safety margin cus we can't have 0-length sections apparently
-                if difference < rel:
-                    rel -= difference
+                difference -= rel
+                rel = 1
+                if difference < dec:
+                    dec -= difference
                 else:
-                    difference -= rel
-                    rel = 1
-                    if difference < dec:
-                        dec -= difference
-                    else:
-                        difference -= dec
-                        dec = 1
-                        atk -= difference
-            self.factory.soundchunks[self.location].signal *= gensound.transforms.ADSR(attack = atk, decay = dec, sustain = sus, release = rel)
+                    difference -= dec
+                    dec = 1
+                    atk = max(0, atk - difference)
+        return DSP.adsr_envelope(atk, dec, sustain, rel, length)
+    def envelope(self, length):
+        key = (*self.setting_numbers().tolist(), self.factory.chunk_length, length)
+        return ADSR.envelope_cache.get(key, lambda: ADSR.make_envelope(*key))
+    def job(self):
+        if self.location in self.factory.soundchunks:
+            signal = self.factory.soundchunks[self.location].signal
+            return ('envelope', (signal, self.envelope(len(signal))))
+    def operate(self):
+        if self.location in self.factory.soundchunks:
+            self.factory.soundchunks[self.location].signal = self.run_job()
             self.factory.soundchunks[self.location].velocity = self.direction
             self.stamp_colour(self.factory.soundchunks[self.location])
 
 class Combine(FactoryComponent):
+    __slots__ = ()
     name = 'combine'
     sprite_name = 'combine'
     info = 'mixes two blocks, by taking in one and storing it, then taking in the next and producing an average of the two'
-    stored_chunk = None
+    stored_chunk = StoredAttribute(None)
+    characteristic_colour = StoredAttribute((255,255,255))
+    def job(self):
+        if self.location in self.factory.soundchunks and self.stored_chunk is not None:
+            return ('mix', ([self.stored_chunk.signal, self.factory.soundchunks[self.location].signal],))
     def operate(self):
         if self.location in self.factory.soundchunks:
             if self.stored_chunk is not None:
                 self.characteristic_colour = self.factory.soundchunks[self.location].colour
-                self.factory.create_soundchunk(self.stored_chunk.signal + self.factory.soundchunks[self.location].signal,
-                                               self.location)
+                self.factory.create_soundchunk(self.run_job(), self.location)
                 self.factory.soundchunks[self.location].colour = self.stored_chunk.colour
                 self.stamp_colour(self.factory.soundchunks[self.location])
                 self.factory.soundchunks[self.location].velocity = self.direction
@@ -360,36 +2077,47 @@ class Combine(FactoryComponent):
         
 
 class Output(FactoryComponent):
+    __slots__ = ()
     name = 'output'
     sprite_name = 'output'
+    map_colour = (255,255,255)
     info = 'plays the sound of the blocks that enter it, consuming them in the process.'
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def created(self):
         self.direction = Compass.NORTH
     def operate(self):
         if self.location in self.factory.soundchunks:
             chunk = self.factory.soundchunks.pop(self.location)
-            self.factory.outputs_this_step.append(chunk.signal)
+            self.factory.outputs_this_step.append((self.location, chunk.signal))
 
 class Destroyer(FactoryComponent):
+    __slots__ = ()
     name = 'destroyer'
     sprite_name = 'destroy'
+    map_colour = (0,0,0)
     info = 'consumes blocks that enter it without playing them. used to get rid of unwanted blocks so they don\'t clog up the system.'
     def operate(self):
         if self.location in self.factory.soundchunks:
             self.factory.soundchunks.pop(self.location)
 
 class Squisher(FactoryComponent):
+    __slots__ = ()
     name = 'squisher'
     sprite_name = 'squish'
-    stored_chunk = None
-    info = 'takes two blocks in, one at a time, then produces a block consisting of the two concatenated then doubled in speed so the result remains the same length as the inputs.'
+    stored_chunk = StoredAttribute(None)
+    characteristic_colour = StoredAttribute((255,255,255))
+    info = 'takes two blocks in, one at a time, then produces a block consisting of the two concatenated then doubled in speed so the result remains the same length as the inputs. sinc interpolation sounds cleaner but takes longer.'
+    @staticmethod
+    def make_settings():
+        return {'interpolation': MultipleChoiceSetting('interpolation', (10,50), ['linear', 'sinc'])}
+    def job(self):
+        if self.location in self.factory.soundchunks and self.stored_chunk is not None:
+            return ('squish', (self.stored_chunk.signal, self.factory.soundchunks[self.location].signal,
+                               self.setting('interpolation')))
     def operate(self):
         if self.location in self.factory.soundchunks:
             if self.stored_chunk is not None:
                 self.characteristic_colour = self.factory.soundchunks[self.location].colour
-                self.factory.create_soundchunk((self.stored_chunk.signal * Stretch(rate=2)) | (self.factory.soundchunks[self.location].signal * Stretch(rate=2)),
-                                               self.location)
+                self.factory.create_soundchunk(self.run_job(), self.location)
                 self.factory.soundchunks[self.location].colour = self.stored_chunk.colour
                 self.stamp_colour(self.factory.soundchunks[self.location])
                 self.factory.soundchunks[self.location].velocity = self.direction
@@ -398,27 +2126,41 @@ class Squisher(FactoryComponent):
                 self.stored_chunk = self.factory.soundchunks.pop(self.location)
 
 class Stretcher(FactoryComponent):
+    __slots__ = ()
     name = 'stretcher'
     sprite_name = 'stretch'
-    info = 'takes a block and produces two blocks in a row that are the first and second half of the input block, halved in speed so that each is the length of the input block.'
-    stored_chunk = None
-    characteristic_colour = (255,255,255)
+    info = 'takes a block and produces two blocks in a row that are the first and second half of the input block, halved in speed so that each is the length of the input block. sinc interpolation sounds cleaner but takes longer.'
+    stored_chunk = StoredAttribute(None)
+    stretched = StoredAttribute(None) # the whole stored block slowed down, which both halves are slices of
+    @staticmethod
+    def make_settings():
+        return {'interpolation': MultipleChoiceSetting('interpolation', (10,50), ['linear', 'sinc'])}
+    def job(self):
+        if self.stored_chunk is None and self.location in self.factory.soundchunks:
+            return ('stretch', (self.factory.soundchunks[self.location].signal, 0.5, self.setting('interpolation')))
     def operate(self):
         if self.stored_chunk is not None:
-            self.factory.create_soundchunk((self.stored_chunk.signal * Stretch(rate=0.5))[1e3 * self.factory.chunk_length:], self.location)
+            if self.stretched is None: # loaded from a save, which only keeps the stored block
+                self.stretched = DSP.stretch(self.stored_chunk.signal, 0.5, self.setting('interpolation'))
+            self.factory.create_soundchunk(self.stretched[DSP.samples(self.factory.chunk_length):], self.location)
             self.factory.soundchunks[self.location].colour = self.stored_chunk.colour
             self.stored_chunk = None
+            self.stretched = None
             self.opengates = True
         elif self.location in self.factory.soundchunks:
+            self.stretched = self.run_job()
             self.stored_chunk = self.factory.soundchunks.pop(self.location)
             self.opengates = False
-            self.factory.create_soundchunk((self.stored_chunk.signal * Stretch(rate=0.5))[:1e3 * self.factory.chunk_length], self.location)
+            self.factory.create_soundchunk(self.stretched[:DSP.samples(self.factory.chunk_length)], self.location)
             self.factory.soundchunks[self.location].colour = self.stored_chunk.colour
         if self.location in self.factory.soundchunks:
             self.stamp_colour(self.factory.soundchunks[self.location])
             self.factory.soundchunks[self.location].velocity = self.direction
+    def is_busy(self):
+        return self.stored_chunk is not None
 
 class Delay(FactoryComponent):
+    __slots__ = ()
     name = 'delay'
     sprite_name = 'delay'
     info = 'takes a block, waits one step, then releases it. produces an output stream with gaps in.'
@@ -428,12 +2170,15 @@ class Delay(FactoryComponent):
             self.factory.soundchunks[self.location].velocity = self.direction
         elif self.location in self.factory.soundchunks:
             self.opengates = False
+    def is_busy(self):
+        return not self.opengates
 
 class SplitPath(FactoryComponent):
+    __slots__ = ()
     name = 'split path'
     sprite_name = 'splitpath'
     info = 'alternates between sending its input blocks left or right.'
-    tick = True
+    tick = StoredAttribute(True)
     def operate(self):
         if self.location in self.factory.soundchunks:
             if self.tick:
@@ -444,6 +2189,7 @@ class SplitPath(FactoryComponent):
                 self.tick = True
 
 class SoundChunk:
+    __slots__ = ('factory', 'location', 'signal', 'moved_this_tick', 'velocity', 'colour', 'moved_at', 'previous_location')
     def __init__(self, factory, location, signal):
         self.factory = factory
         self.location = location
@@ -453,28 +2199,58 @@ class SoundChunk:
         self.colour = (0,0,0)
         self.moved_at = 0
         self.previous_location = location
-    def move(self):
+    def copy(self):
+        chunk = SoundChunk(self.factory, self.location, self.signal)
+        chunk.velocity = self.velocity
+        chunk.colour = self.colour
+        chunk.moved_at = self.moved_at
+        chunk.previous_location = self.previous_location
+        return chunk
+    def __setstate__(self, state):
+        # pickled chunks have their attributes as (None, slots), or as a dict from before there were slots,
+        # which may be missing some that were added since
+        if isinstance(state, tuple):
+            state = state[1]
+        SoundChunk.__init__(self, None, None, None)
+        for name, value in state.items():
+            if name in SoundChunk.__slots__:
+                setattr(self, name, value)
+    def move(self, moved=None):
+        # a chunk can only move if whatever's in front of it moves first, so this follows the line of chunks
+        # in front until it ends, then moves them from the front back. it's done with a stack rather than
+        # recursion so there's no limit on how long the line can be. chunks it gets to are added to moved.
         if self.moved_this_tick:
             return True
-        else:
-            self.moved_this_tick = True
-            target_space = (self.location[0]+self.velocity[0],self.location[1]+self.velocity[1])
-            if target_space in self.factory.soundchunks:
-                self.factory.soundchunks[target_space].move()
-            if target_space not in self.factory.soundchunks and target_space in self.factory.components and self.factory.components[target_space].opengates: # still, ie. the one that was already there isn't blocked and has moved out the way, and the component isn't blocking input
-                self.moved_at = pg.time.get_ticks()
-                self.previous_location = self.location
-                self.factory.move_soundchunk(self.location, self.velocity)
-            self.velocity = Compass.STATIONARY
-    def draw(self, screen):
-        progress = min(1, (pg.time.get_ticks() - self.moved_at) / ((self.factory.chunk_length*1000) / 2))
+        stack = [(self, False)]
+        while len(stack) > 0:
+            chunk, resolving = stack.pop()
+            target_space = (chunk.location[0]+chunk.velocity[0],chunk.location[1]+chunk.velocity[1])
+            if not resolving:
+                if chunk.moved_this_tick:
+                    continue
+                chunk.moved_this_tick = True
+                if moved is not None:
+                    moved.append(chunk)
+                stack.append((chunk, True))
+                if target_space in self.factory.soundchunks:
+                    stack.append((self.factory.soundchunks[target_space], False))
+            else:
+                if target_space not in self.factory.soundchunks and self.factory.components.accepts(target_space): # still, ie. the one that was already there isn't blocked and has moved out the way, and the component isn't blocking input
+                    chunk.moved_at = time.monotonic()
+                    chunk.previous_location = chunk.location
+                    self.factory.move_soundchunk(chunk.location, chunk.velocity)
+                chunk.velocity = Compass.STATIONARY
+    def draw_rect(self):
+        progress = min(1, (time.monotonic() - self.moved_at) / (self.factory.chunk_length / 2))
         moving_location = ((self.location[0]*progress) + (self.previous_location[0]*(1-progress)),
                            (self.location[1]*progress) + (self.previous_location[1]*(1-progress)))
         draw_location = self.factory.floorlocation_to_screenlocation(moving_location)
-        chunk_sfc = pg.Surface((int(self.factory.viewscale*0.8), int(self.factory.viewscale*0.8)))
-        chunk_sfc.set_alpha(128)
-        chunk_sfc.fill(self.colour)
-        screen.blit(chunk_sfc, ((draw_location[0]+(self.factory.viewscale//10), draw_location[1]+(self.factory.viewscale//10))))
+        return pg.Rect(draw_location[0]+(self.factory.viewscale//10), draw_location[1]+(self.factory.viewscale//10),
+                       int(self.factory.viewscale*0.8), int(self.factory.viewscale*0.8))
+    def draw(self, screen, rect=None):
+        if rect is None:
+            rect = self.draw_rect()
+        screen.blit(Sprites.get_chunk_tile(self.colour, rect.w), rect)
 
 
 class FactoryUI:
@@ -484,28 +2260,64 @@ class FactoryUI:
         self.current_view = 'factory' # or 'settings' or 'component menu' or a specific component's settings
         self.component_menu = component_menu
         self.screen_width = 1
+        self.screen_height = 1
         self.font = pg.font.Font(size=30)
+        self.small_font = pg.font.Font(size=20)
         self.save_button_rect = None
         self.load_button_rect = None
         self.playing = True
+        self.scheduler = None # a RenderAhead that's stepping the factory, if there is one
+        self.shown_chunks = factory.get_state()[0] # snapshot of the chunks for the step being heard, which is all that's drawn
+        self.trace_file = None # where to write the profiler's trace when the editor closes, if anywhere
+        self.step_clock = None # the StepClock timing steps as they're played, if there is one
+        self.show_minimap = True
+        self.minimap = None # (rect on screen, tile at its top left, pixels per tile) where the minimap was last drawn
+        self.shown_step = 0 # steps the factory had taken after the one currently being heard
+        self.scrub_preview = None # step the scrub bar's being dragged to, if it is
+        self.jumped = False # whether it's been seeked since run last looked, so steps rendered before can be dropped
         Sprites.font = self.font
+    def editing(self):
+        # anything that changes the factory should happen inside this, so that steps already rendered
+        # ahead get thrown away and redone with the change
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.edit()
     def draw(self, screen):
+        # returns the list of rects on the screen that changed, or None if all of it did
         w,h = screen.get_size()
         self.screen_width = w
+        self.screen_height = h
+        if self.current_view != 'factory':
+            self.factory.redraw_all()
         if self.current_view == 'component menu':
             screen.fill((10,10,10))
             for i in range(len(self.component_menu)):
-                screen.blit(pg.transform.scale(Sprites.get_sprite('component', self.component_menu[i].sprite_name), (40,40)), (((i%(w//50))*50)+5,((i//(w//50))*50)+5))
+                screen.blit(Sprites.get_transformed('component', self.component_menu[i].sprite_name, Compass.NORTH, 40), (((i%(w//50))*50)+5,((i//(w//50))*50)+5))
         elif self.current_view == 'factory':
-            self.factory.draw(screen)
-            screen.blit(pg.transform.scale(Sprites.get_sprite('icon', 'settings'), (50,50)), (5,5))
+            dirty = self.factory.draw(screen, self.shown_chunks)
+            screen.blit(Sprites.get_transformed('icon', 'settings', Compass.NORTH, 50), (5,5))
             if self.playing:
-                screen.blit(pg.transform.scale(Sprites.get_sprite('icon', 'pause'), (50,50)), (5,60))
+                screen.blit(Sprites.get_transformed('icon', 'pause', Compass.NORTH, 50), (5,60))
             else:
-                screen.blit(pg.transform.scale(Sprites.get_sprite('icon', 'play'), (50,50)), (5,60))
+                screen.blit(Sprites.get_transformed('icon', 'play', Compass.NORTH, 50), (5,60))
             pg.draw.rect(screen, (10,10,10), (60,5,50,50))
             if self.currentcomponent is not None:
-                screen.blit(pg.transform.scale(Sprites.get_sprite('component', self.currentcomponent.sprite_name), (40,40)), (65,10))
+                screen.blit(Sprites.get_transformed('component', self.currentcomponent.sprite_name, Compass.NORTH, 40), (65,10))
+            if self.show_minimap:
+                area = self.draw_minimap(screen)
+                if dirty is not None:
+                    dirty.append(area)
+            if self.factory.timeline is not None:
+                area = self.draw_scrubber(screen)
+                if dirty is not None:
+                    dirty.append(area)
+            if self.factory.profiler is not None:
+                self.draw_profile(screen)
+                self.factory.redraw_all() # the overlay changes every frame and covers the floor
+                return None
+            if dirty is not None:
+                dirty.append(pg.Rect(0,0,115,115)) # the buttons are always redrawn
+            return dirty
         elif self.current_view == 'settings':
             screen.fill((10,10,10))
             title = Sprites.get_sprite('text', 'factory settings')
@@ -529,18 +2341,125 @@ class FactoryUI:
             pg.draw.rect(screen, (50,50,50), (title.get_size()[0] + 20, 0, *info.get_size()))
             screen.blit(info, (title.get_size()[0]+20, 0))
             pg.draw.rect(screen, (255,0,0), (self.screen_width - 50, 0, 50, 50))
+            if isinstance(self.current_view, SamplePlayer):
+                choose = Sprites.get_sprite('text', 'choose file')
+                pg.draw.rect(screen, (50,50,50), (title.get_size()[0] + info.get_size()[0] + 40, 0, *choose.get_size()))
+                screen.blit(choose, (title.get_size()[0] + info.get_size()[0] + 40, 0))
+                filename = self.current_view.sample_file
+                screen.blit(self.small_font.render(os.path.basename(filename) if filename is not None else 'no file chosen', True, (255,255,255)), (10, 400))
             for setting in self.current_view.settings.values():
                 setting.draw(screen, self.font)
+        return None
+    def draw_profile(self, screen):
+        # heat map of the slowest tiles lately, and recent step times against the time each step has to play
+        profiler = self.factory.profiler
+        slowest = profiler.slowest_tiles(50)
+        if len(slowest) > 0:
+            most = slowest[0][1]
+            for location, seconds in slowest:
+                heat = pg.Surface((self.factory.viewscale, self.factory.viewscale), pg.SRCALPHA)
+                heat.fill((255, 0, 0, int(200 * seconds / most)))
+                screen.blit(heat, self.factory.floorlocation_to_screenlocation(location))
+        w,h = screen.get_size()
+        graph = pg.Rect(5, h - 143, 300, 80)
+        pg.draw.rect(screen, (10,10,10), graph)
+        steps = list(profiler.steps)[-graph.w // 3:]
+        for i, step in enumerate(steps):
+            fraction = min(1, step['duration'] / step['budget'])
+            colour = (255,0,0) if fraction >= 1 else (0,200,0) if fraction < 0.5 else (255,200,0)
+            bar_height = max(1, int(graph.h * fraction))
+            pg.draw.rect(screen, colour, (graph.x + (i*3), graph.bottom - bar_height, 2, bar_height))
+        if len(steps) > 0:
+            step = steps[-1]
+            draw_ms = 1000 * (sum(profiler.draw_times) / max(1, len(profiler.draw_times)))
+            lines = [f"step {1000*step['duration']:.1f} ms of {1000*step['budget']:.0f} ms ({100*step['duration']/step['budget']:.1f}%)",
+                     f"operate {1000*step['operate']:.1f} move {1000*step['move']:.1f} mix {1000*step['mix']:.1f} ms, {step['chunks']} chunks, draw {draw_ms:.1f} ms"]
+            jitter = None if self.step_clock is None else self.step_clock.jitter()
+            if jitter is not None:
+                lines.append(f"timing {jitter['mean_ms']:+.2f} ms, jitter {jitter['p95_ms']:.2f} ms (95%) {jitter['max_ms']:.2f} ms (max) over {jitter['steps']} steps")
+            for i, line in enumerate(lines):
+                text = self.small_font.render(line, True, (255,255,255), (10,10,10))
+                screen.blit(text, (5, h - 58 + (i*18)))
+    def draw_minimap(self, screen):
+        # the whole floor in the bottom right corner, made from the factory's FloorMap, with the area in view
+        # outlined. returns the area of the screen it covers
+        w,h = screen.get_size()
+        factory = self.factory
+        view = (factory.viewlocation[0], factory.viewlocation[1],
+                factory.viewlocation[0] + math.ceil(w/factory.viewscale), factory.viewlocation[1] + math.ceil(h/factory.viewscale))
+        factory.floor_map.update(factory, self.shown_chunks)
+        surface, origin, scale = factory.floor_map.minimap(view, 200)
+        rect = pg.Rect(w - surface.get_width() - 7, h - surface.get_height() - 7, *surface.get_size())
+        if self.minimap is not None and self.minimap[0] != rect: # it's changed size, so what it covered before needs drawing again
+            factory.redraw_all()
+        pg.draw.rect(screen, (10,10,10), rect.inflate(4,4))
+        screen.blit(surface, rect)
+        outline = pg.Rect(rect.x + int((view[0] - origin[0]) * scale), rect.y + int((view[1] - origin[1]) * scale),
+                          max(2, int((view[2] - view[0]) * scale)), max(2, int((view[3] - view[1]) * scale)))
+        pg.draw.rect(screen, (255,0,0), outline.clip(rect), width=1)
+        self.minimap = (rect, origin, scale)
+        return rect.inflate(4,4)
+    def scrubber(self):
+        # where the scrub bar is on the screen, and the step at its right hand end, which is a bit past the
+        # furthest the factory's got so there's room to seek ahead
+        return pg.Rect(120, 5, self.screen_width - 130, 20), max(64, (self.factory.timeline.furthest * 5) // 4)
+    def draw_scrubber(self, screen):
+        # a bar along the top for seeking through the factory's timeline: the part it's been through is
+        # lighter, with a tick at each snapshot, and there's a marker at the step being heard (or the one it's
+        # being dragged to). returns the area of the screen it covers
+        timeline = self.factory.timeline
+        rect, end = self.scrubber()
+        pg.draw.rect(screen, (10,10,10), rect)
+        pg.draw.rect(screen, (50,50,50), (rect.x, rect.y, (rect.w * min(end, timeline.furthest)) // end, rect.h))
+        for step in list(timeline.snapshots): # the render-ahead worker adds to them
+            x = rect.x + ((rect.w * step) // end)
+            pg.draw.line(screen, (120,120,120), (x, rect.bottom - 5), (x, rect.bottom - 1))
+        step = self.shown_step if self.scrub_preview is None else self.scrub_preview
+        x = rect.x + ((rect.w * min(end, step)) // end)
+        pg.draw.rect(screen, (255,0,0) if self.scrub_preview is None else (255,200,0), (x - 1, rect.y, 3, rect.h))
+        screen.blit(self.small_font.render(f'step {step}', True, (255,255,255)), (rect.x + 4, rect.y + 4))
+        return rect
+    def scrubber_step(self, pos):
+        # the step at pos on the scrub bar, or None if it's not on it
+        if self.factory.timeline is None:
+            return None
+        rect, end = self.scrubber()
+        if not rect.collidepoint(pos):
+            return None
+        return ((pos[0] - rect.x) * end) // rect.w
+    def seek(self, steps):
+        with self.editing():
+            # edits clear the timeline, so it can't go back to before the last one
+            steps = max(steps, min(self.factory.timeline.snapshots, default=self.factory.steps_taken))
+            self.factory.seek(steps)
+            self.shown_chunks = self.factory.get_state()[0]
+        self.shown_step = steps
+        self.jumped = True
+        self.factory.redraw_all()
+    def minimap_clicked(self, pos):
+        # moves the view to be centred on where pos is on the minimap, if it's on it
+        if not self.show_minimap or self.minimap is None or not self.minimap[0].collidepoint(pos):
+            return False
+        rect, origin, scale = self.minimap
+        viewscale = self.factory.viewscale
+        self.factory.viewlocation = [origin[0] + int((pos[0] - rect.x) / scale) - (self.screen_width // viewscale // 2),
+                                     origin[1] + int((pos[1] - rect.y) / scale) - (self.screen_height // viewscale // 2)]
+        return True
     def mousedrag(self, pos):
-        if isinstance(self.current_view, FactoryComponent):
+        if self.current_view == 'factory':
+            self.scrub_preview = self.scrubber_step(pos)
+            self.minimap_clicked(pos)
+        elif isinstance(self.current_view, FactoryComponent):
             for setting in self.current_view.settings.values():
-                if setting.rect.collidepoint(pos):
-                    setting.mousedrag(pos)
+                if setting.collidepoint(pos):
+                    with self.editing():
+                        setting.mousedrag(pos)
                     break
         elif self.current_view == 'settings':
             for setting in self.factory.settings.values():
-                if setting.rect.collidepoint(pos):
-                    setting.mousedrag(pos)
+                if setting.collidepoint(pos):
+                    with self.editing():
+                        setting.mousedrag(pos)
                     break
     def leftbuttondown(self, pos):
         pass
@@ -552,6 +2471,7 @@ class FactoryUI:
                 self.currentcomponent = self.component_menu[item_clicked]
                 self.current_view = 'factory'
         elif self.current_view == 'factory':
+            self.scrub_preview = None
             if pg.Rect(60,5,50,50).collidepoint(pos):
                 self.current_view = 'component menu'
                 return True
@@ -561,18 +2481,26 @@ class FactoryUI:
             elif pg.Rect(5,60,50,50).collidepoint(pos):
                 self.playing = not self.playing
                 return True
+            elif self.minimap_clicked(pos):
+                return True
+            elif self.scrubber_step(pos) is not None:
+                self.seek(self.scrubber_step(pos))
+                return True
             position = self.factory.screenlocation_to_floorlocation(pos)
             if position in self.factory.components:
                 if pg.key.get_mods() & pg.KMOD_SHIFT:
                     self.current_view = self.factory.components[position]
                 else:
-                    self.factory.components[position].rotate()
+                    with self.editing():
+                        self.factory.components[position].rotate()
             else:
                 if self.currentcomponent is not None:
-                    self.factory.create_component(self.currentcomponent, position, Compass.NORTH)
+                    with self.editing():
+                        self.factory.create_component(self.currentcomponent, position, Compass.NORTH)
         elif self.current_view == 'settings':
             if pg.Rect(self.screen_width- 50, 0, 50, 50).collidepoint(pos):
-                self.factory.settings_changed()
+                with self.editing():
+                    self.factory.settings_changed()
                 self.current_view = 'factory'
             elif self.save_button_rect.collidepoint(pos):
                 self.save()
@@ -580,46 +2508,80 @@ class FactoryUI:
                 self.load()
             else:
                 for setting in self.factory.settings.values():
-                    if setting.rect.collidepoint(pos):
-                        setting.mouseup(pos)
+                    if setting.collidepoint(pos):
+                        with self.editing():
+                            setting.mouseup(pos)
                         break
         elif isinstance(self.current_view, FactoryComponent):
             if pg.Rect(self.screen_width- 50, 0, 50, 50).collidepoint(pos):
-                self.current_view.settings_changed()
+                with self.editing():
+                    self.current_view.settings_changed()
                 self.current_view = 'factory'
             elif pg.Rect(Sprites.get_sprite('text', self.current_view.name).get_size()[0] + 20, 0, *Sprites.get_sprite('text', 'info').get_size()).collidepoint(pos):
                 self.show_info(self.current_view)
+            elif isinstance(self.current_view, SamplePlayer) and pg.Rect(sum(Sprites.get_sprite('text', text).get_size()[0] for text in [self.current_view.name, 'info']) + 40, 0, *Sprites.get_sprite('text', 'choose file').get_size()).collidepoint(pos):
+                self.choose_sample(self.current_view)
             else:
                 for setting in self.current_view.settings.values():
-                    if setting.rect.collidepoint(pos):
-                        setting.mouseup(pos)
+                    if setting.collidepoint(pos):
+                        with self.editing():
+                            setting.mouseup(pos)
                         break
     def rightbuttondown(self, pos):
         pass
     def rightbuttonup(self, pos):
         position = self.factory.screenlocation_to_floorlocation(pos)
         if position in self.factory.components:
-            self.factory.remove_component(position)
+            with self.editing():
+                self.factory.remove_component(position)
     def keyup(self, keyevent):
         if self.current_view == 'factory':
+            pan = max(1, 50 // self.factory.viewscale) # tiles, so it's about the same distance on screen however zoomed out it is
             if keyevent.key == pg.K_UP:
-                self.factory.viewlocation[1] -= 1
+                self.factory.viewlocation[1] -= pan
             elif keyevent.key == pg.K_DOWN:
-                self.factory.viewlocation[1] += 1
+                self.factory.viewlocation[1] += pan
             elif keyevent.key == pg.K_LEFT:
-                self.factory.viewlocation[0] -= 1
+                self.factory.viewlocation[0] -= pan
             elif keyevent.key == pg.K_RIGHT:
-                self.factory.viewlocation[0] += 1
+                self.factory.viewlocation[0] += pan
             elif keyevent.key == pg.K_MINUS:
                 if self.factory.viewscale > 10:
                     self.factory.viewscale -= 10
+                elif self.factory.viewscale > 1:
+                    self.factory.viewscale = max(1, self.factory.viewscale // 2)
             elif keyevent.key == pg.K_EQUALS:
-                self.factory.viewscale += 10
+                if self.factory.viewscale < 10:
+                    self.factory.viewscale = min(10, self.factory.viewscale * 2)
+                else:
+                    self.factory.viewscale += 10
+            elif keyevent.key == pg.K_p:
+                self.toggle_profiling()
+            elif keyevent.key == pg.K_m:
+                self.show_minimap = not self.show_minimap
+                self.factory.redraw_all()
+    def toggle_profiling(self):
+        if self.factory.profiler is None:
+            self.factory.profiler = Profiler()
+        else:
+            if self.trace_file is not None:
+                self.factory.profiler.dump(self.trace_file)
+            self.factory.profiler = None
     def show_info(self, component):
         root = tk.Tk()
         root.withdraw()
         messagebox.showinfo(title=component.name, message=component.info)
         root.destroy()
+    def choose_sample(self, component):
+        root = tk.Tk()
+        root.withdraw()
+        filename = filedialog.askopenfilename(filetypes=[('wav files', '*.wav'), ('raw 16-bit pcm', '*.raw *.pcm'), ('all files', '*')])
+        if filename:
+            with self.editing():
+                component.choose_file(filename)
+            if SampleFile.open(filename) is None:
+                messagebox.showwarning('could not open file', f'{filename} isn\'t a wav file this can play')
+        root.destroy()
     def load(self):
         root = tk.Tk()
         root.withdraw()
@@ -628,7 +2590,17 @@ class FactoryUI:
             messagebox.showwarning('could not open file', 'an error occured while trying to open the file, do you have the right permissions?')
         else:
             try:
-                self.factory = pickle.load(file)
+                parallel = self.factory.parallel
+                self.factory = load_factory(file)
+                self.factory.parallel = parallel
+                self.factory.timeline = Timeline()
+                self.shown_step = 0
+                self.jumped = True
+                if self.scheduler is not None:
+                    self.scheduler.set_factory(self.factory)
+                    self.shown_chunks = self.scheduler.shown_chunks()
+                else:
+                    self.shown_chunks = self.factory.get_state()[0]
             except Exception as e:
                 messagebox.showwarning(f'could not load file', 'an error occured while trying to load save data from the file: {e}')
         root.destroy()
@@ -640,20 +2612,724 @@ class FactoryUI:
         if file is None:
              messagebox.showwarning('could not open file', 'an error occured while trying to create/open the file, do you have the right permissions for that folder?')
         else:
-            pickle.dump(self.factory, file)
+            with self.editing():
+                save_factory(self.factory, file)
+            file.close()
         root.destroy()
         self.current_view = 'factory'
             
 
-def run():
+class LegacyComponent:
+    # what components pickled by older versions, when each one was an object of its own, are unpickled as.
+    # FactoryFloor.__setstate__ moves them into its ComponentStore
+    kind = None
+    def move_into(self, factory, location):
+        old = self.__dict__
+        component = factory.components.add(self.kind, location, old.get('direction', Compass.NORTH), old.get('order', 0))
+        # settings added since it was saved are left at their defaults
+        columns = kind_settings(self.kind)[0]
+        for name, widget in old.get('settings', {}).items():
+            if name in columns:
+                component.set_setting(name, widget.get_value())
+        for name in ['opengates', 'tick', 'stored_chunk', 'stretched', 'characteristic_colour']:
+            if name in old and any(isinstance(vars(kind).get(name), StoredAttribute) for kind in self.kind.__mro__):
+                setattr(component, name, old[name])
+        component.settings_changed()
+
+class FactoryUnpickler(pickle.Unpickler):
+    # factories saved from the UI were pickled with this file running as __main__, so point those classes
+    # back at this module whatever name it was imported under. components are only pickled by older
+    # versions, so they come back as LegacyComponents
+    def find_class(self, module, name):
+        if module in ['__main__', __name__] and name in [kind.__name__ for kind in COMPONENT_KINDS]:
+            return type(name, (LegacyComponent,), {'kind': getattr(sys.modules[__name__], name)})
+        if module == '__main__':
+            return getattr(sys.modules[__name__], name)
+        return super().find_class(module, name)
+
+SAVE_MAGIC = b'SNDFCTRY'
+SAVE_VERSION = 4 # 2 added the mixer settings to the factory settings, 3 added sample players, 4 split the settings by kind
+DIRECTIONS = [Compass.NORTH, Compass.EAST, Compass.SOUTH, Compass.WEST]
+COMPONENT_KINDS = [Oscillator, Conveyor, Output, Destroyer, ADSR, SplitPath, Delay, Squisher, Stretcher, Combine, SamplePlayer]
+
+# save files are laid out as:
+#   magic, version and header length (as in SAVE_HEADER), then the header as json
+#   component locations (int32, n x 2), kinds (uint8, n) and directions (uint8, n), for the n components in
+#     the order they were created, then a table of settings (float64, components of the kind x its settings)
+#     for each kind in the header's settings that has any, in the order the header lists the kinds, then
+#     flags (uint8, n). before version 4 the settings were one table (float64, n x settings_width)
+#   if the header says it includes the state: chunk locations (int32, m x 2), whether each chunk is held
+#     in a component rather than on the floor (uint8, m), colours (float32, m x 3), lengths (int64, m),
+#     then all the chunks' samples one after another (float32)
+# all little-endian. a component's settings are stored in the order listed for its kind in the header, with
+# multiple choice settings as the index of the option.
+SAVE_HEADER = struct.Struct('<8sII')
+FLAG_GATES_CLOSED = 1
+FLAG_TICK_OFF = 2
+
+def write_array(file, array, dtype):
+    file.write(np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<')).tobytes())
+
+def read_array(file, dtype, shape):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    count = math.prod(shape)
+    data = file.read(count * dtype.itemsize)
+    if len(data) != count * dtype.itemsize:
+        raise Exception('save file is truncated')
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+def components_header(store, rows, include_state=True):
+    # the parts of the header describing the components in rows of a ComponentStore, which read_components
+    # needs to read them back. sample players' files (and with the state, where they've got to) are in here
+    # too, by the component's index in rows
+    setting_names = {}
+    for kind_index in np.unique(store.kinds[rows]).tolist():
+        kind = COMPONENT_KINDS[kind_index]
+        setting_names[kind.__name__] = list(kind_settings(kind)[0])
+    index = {row: i for i, row in enumerate(rows.tolist())}
+    header = {'kinds': [kind.__name__ for kind in COMPONENT_KINDS], 'settings': setting_names, 'components': len(rows),
+              'sample_files': {str(index[row]): name for row, name in store.attributes['sample_file'].items() if row in index}}
+    if include_state:
+        header['playheads'] = {str(index[row]): playhead for row, playhead in store.attributes['playhead'].items() if row in index}
+    return header
+
+def write_components(file, store, rows, header, include_state):
+    # the store's arrays are written more or less as they are, since the header lists the kinds in the same
+    # order as COMPONENT_KINDS
+    kinds = store.kinds[rows]
+    flags = np.zeros(len(rows), dtype=np.uint8)
+    if include_state:
+        index = {row: i for i, row in enumerate(rows.tolist())}
+        for name, flag, off in [('opengates', FLAG_GATES_CLOSED, False), ('tick', FLAG_TICK_OFF, False)]:
+            for row, value in store.attributes[name].items():
+                if value is off and row in index:
+                    flags[index[row]] |= flag
+    write_array(file, store.locations[rows], 'i4')
+    write_array(file, kinds, 'u1')
+    write_array(file, store.directions[rows], 'u1')
+    for kind_index, kind in enumerate(COMPONENT_KINDS):
+        if len(header['settings'].get(kind.__name__, [])) > 0:
+            write_array(file, store.tables[kind.__name__][store.setting_rows[rows[kinds == kind_index]]], 'f8')
+    write_array(file, flags, 'u1')
+
+def read_components(file, factory, header):
+    kinds = [getattr(sys.modules[__name__], name) for name in header['kinds']]
+    n = header['components']
+    locations = read_array(file, 'i4', (n, 2))
+    kind_indices = read_array(file, 'u1', (n,))
+    directions = read_array(file, 'u1', (n,))
+    tables = {} # kind's name: its components' settings, in the order they were saved
+    if 'settings_width' in header: # from before version 4, when the settings were all in one table
+        settings = read_array(file, 'f8', (n, header['settings_width']))
+        for kind_index, name in enumerate(header['kinds']):
+            tables[name] = settings[kind_indices == kind_index]
+    else:
+        for kind_index, name in enumerate(header['kinds']):
+            if len(header['settings'].get(name, [])) > 0:
+                tables[name] = read_array(file, 'f8', (int(np.count_nonzero(kind_indices == kind_index)), len(header['settings'][name])))
+    flags = read_array(file, 'u1', (n,))
+    # the components go into the store a kind at a time rather than through create_component, since this is
+    # the slow part of loading a big factory, and what changing their settings would do is done a kind at a
+    # time too (see settings_loaded). only the components that have flags set get looked at one by one.
+    # returns their rows in the store, in the order they were saved
+    store = factory.components
+    rows = np.zeros(n, dtype=np.int64)
+    for kind_index, kind in enumerate(kinds):
+        selected = np.flatnonzero(kind_indices == kind_index)
+        if len(selected) == 0:
+            continue
+        rows[selected] = store.add_many(kind, locations[selected], directions[selected], 0)
+        columns = kind_settings(kind)[0]
+        if len(columns) > 0:
+            # settings the kind no longer has are dropped, and ones it didn't have yet stay at their defaults
+            for j, name in enumerate(header['settings'].get(kind.__name__, [])):
+                if name in columns:
+                    store.tables[kind.__name__][store.setting_rows[rows[selected]], columns[name][0]] = tables[kind.__name__][:,j]
+            kind.settings_loaded(store, rows[selected])
+    for i in np.flatnonzero(flags).tolist():
+        component = store.view(int(rows[i]))
+        if flags[i] & FLAG_GATES_CLOSED:
+            component.opengates = False
+        if flags[i] & FLAG_TICK_OFF:
+            component.tick = False
+    for name in ['sample_file', 'playhead']:
+        for i, value in header.get(name + 's', {}).items():
+            setattr(store.view(int(rows[int(i)])), name, value)
+    return rows
+
+def save_factory(factory, file, include_state=True):
+    # include_state saves the chunks and what the components are holding too, not just the layout
+    store = factory.components
+    store.grid.load_all()
+    rows = np.array([row for location, row in store.grid.items()], dtype=np.int64)
+    rows = rows[np.argsort(store.orders[rows], kind='stable')]
+    chunks = [(chunk, 0) for chunk in factory.soundchunks.values()]
+    chunks += [(chunk, 1) for row, chunk in sorted(store.attributes['stored_chunk'].items())]
+    header = components_header(store, rows, include_state)
+    header.update({'factory_settings': {name: setting.to_number() for name, setting in factory.settings.items()},
+                   'viewscale': factory.viewscale, 'viewlocation': list(factory.viewlocation),
+                   'state': include_state, 'chunks': len(chunks) if include_state else 0})
+    encoded = json.dumps(header).encode()
+    file.write(SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, len(encoded)))
+    file.write(encoded)
+    write_components(file, store, rows, header, include_state)
+    if include_state and len(chunks) > 0:
+        write_array(file, [chunk.location for chunk, held in chunks], 'i4')
+        write_array(file, [held for chunk, held in chunks], 'u1')
+        write_array(file, [chunk.colour for chunk, held in chunks], 'f4')
+        write_array(file, [len(chunk.signal) for chunk, held in chunks], 'i8')
+        for chunk, held in chunks:
+            write_array(file, chunk.signal, 'f4')
+
+def load_saved_factory(file):
+    magic, version, header_length = SAVE_HEADER.unpack(file.read(SAVE_HEADER.size))
+    if version > SAVE_VERSION:
+        raise Exception(f'save file is from a newer version of the sound factory (format {version})')
+    header = json.loads(file.read(header_length))
+    factory = FactoryFloor()
+    for name, number in header['factory_settings'].items():
+        factory.settings[name].from_number(number)
+    factory.settings_changed()
+    factory.viewscale = header['viewscale']
+    factory.viewlocation = header['viewlocation']
+    rows = read_components(file, factory, header)
+    factory.components.orders[rows] = np.arange(len(rows))
+    factory.next_order = len(rows)
+    factory.layout_changed()
+    m = header['chunks']
+    if m > 0:
+        chunk_locations = read_array(file, 'i4', (m, 2)).tolist()
+        held = read_array(file, 'u1', (m,)).tolist()
+        colours = read_array(file, 'f4', (m, 3)).tolist()
+        lengths = read_array(file, 'i8', (m,)).tolist()
+        for i in range(m):
+            location = tuple(chunk_locations[i])
+            chunk = SoundChunk(factory, location, read_array(file, 'f4', (lengths[i],)).astype(np.float32))
+            chunk.colour = tuple(colours[i])
+            if held[i]:
+                factory.components[location].stored_chunk = chunk
+            else:
+                factory.soundchunks[location] = chunk
+    factory.find_busy()
+    return factory
+
+# regions of components that FactoryFloor.stream_regions writes out are laid out like the components in a save
+# file, with a header that only has components_header in it (after its length, as a little-endian uint32),
+# followed by the components' order (int64, n) and characteristic colours (float64, n x 3), so they come back
+# exactly as they were. regions holding chunks are never written out, so there aren't any of those.
+REGION_HEADER = struct.Struct('<I')
+
+def write_region(file, store, rows):
+    header = components_header(store, rows)
+    encoded = json.dumps(header).encode()
+    file.write(REGION_HEADER.pack(len(encoded)))
+    file.write(encoded)
+    write_components(file, store, rows, header, True)
+    write_array(file, store.orders[rows], 'i8')
+    write_array(file, [store.view(row).characteristic_colour for row in rows.tolist()], 'f8')
+
+def read_region(file, factory):
+    header = json.loads(file.read(REGION_HEADER.unpack(file.read(REGION_HEADER.size))[0]))
+    rows = read_components(file, factory, header)
+    n = len(rows)
+    factory.components.orders[rows] = read_array(file, 'i8', (n,))
+    for row, colour in zip(rows.tolist(), read_array(file, 'f8', (n, 3)).tolist()):
+        component = factory.components.view(row)
+        if component.characteristic_colour != tuple(colour): # only kinds that keep their own colour can have changed it
+            component.characteristic_colour = tuple(colour)
+
+def load_factory(file):
+    # reads either format: the current one (see save_factory) or a whole pickled factory as saved by older versions
+    if file.read(len(SAVE_MAGIC)) == SAVE_MAGIC:
+        file.seek(0)
+        return load_saved_factory(file)
+    file.seek(0)
+    factory = FactoryUnpickler(file).load()
+    # older saves hold gensound signals rather than arrays of samples
+    for chunk in list(factory.soundchunks.values()) + list(factory.components.attributes['stored_chunk'].values()):
+        if not isinstance(chunk.signal, np.ndarray):
+            chunk.signal = chunk.signal.realise(SAMPLE_RATE).audio.sum(axis=0).astype(np.float32)
+    factory.outputs_this_step = []
+    factory.find_busy()
+    return factory
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+
+class WavWriter:
+    # 16-bit wav (mono or stereo) written a block at a time. the header's sizes are brought up to date after every block,
+    # so if a render is stopped partway what's there so far is still a valid file, and it can be cut back to
+    # where a checkpoint was made and carried on from there
+    header = struct.Struct('<4sI4s4sIHHIIHH4sI')
+    def __init__(self, filename, resume_frames=None, channels=1):
+        self.channels = channels
+        if resume_frames is None:
+            self.file = open(filename, 'wb')
+            self.frames = 0
+        else:
+            self.file = open(filename, 'r+b')
+            fields = WavWriter.header.unpack(self.file.read(WavWriter.header.size))
+            if fields[0] != b'RIFF' or fields[2] != b'WAVE' or fields[5:8] != (1, channels, SAMPLE_RATE):
+                raise Exception(f'{filename} is not a wav file a render could have written')
+            if os.path.getsize(filename) < WavWriter.header.size + (2 * channels * resume_frames):
+                raise Exception(f'{filename} is shorter than the checkpoint says it should be')
+            self.frames = resume_frames
+            self.file.truncate(WavWriter.header.size + (2 * channels * resume_frames))
+        self.write_header()
+    def write_header(self):
+        frame_size = 2 * self.channels
+        data = frame_size * self.frames
+        self.file.seek(0)
+        self.file.write(WavWriter.header.pack(b'RIFF', 36 + data, b'WAVE', b'fmt ', 16, 1, self.channels, SAMPLE_RATE,
+                                              frame_size * SAMPLE_RATE, frame_size, 16, b'data', data))
+        self.file.seek(0, os.SEEK_END)
+    def write(self, samples):
+        self.file.write(to_pcm16(samples))
+        self.frames += len(samples)
+        self.write_header()
+    def flush(self):
+        self.file.flush()
+    def close(self):
+        self.file.close()
+    def abandon(self):
+        self.file.close()
+
+class FlacWriter:
+    # 16-bit flac (mono or stereo), through the soundfile module (libsndfile), which is only needed for this so isn't
+    # imported until one is made. a flac that's still being written can't be read back or cut short, so each
+    # flush() finishes what's been written since the last one as a file of its own (filename.0.part,
+    # filename.1.part...) and close() joins them up. carrying on from a checkpoint keeps the pieces up to it.
+    def __init__(self, filename, resume_frames=None, channels=1):
+        import soundfile
+        self.soundfile = soundfile
+        self.filename = filename
+        self.channels = channels
+        self.parts = []
+        self.file = None
+        self.frames = 0
+        if resume_frames is not None:
+            while self.frames < resume_frames and os.path.exists(self.part_name(len(self.parts))):
+                self.parts.append(self.part_name(len(self.parts)))
+                self.frames += soundfile.info(self.parts[-1]).frames
+            if self.frames != resume_frames:
+                raise Exception(f'the pieces of {filename} written so far don\'t match the checkpoint')
+            index = len(self.parts)
+            while os.path.exists(self.part_name(index)): # written after the checkpoint
+                os.remove(self.part_name(index))
+                index += 1
+    def part_name(self, index):
+        return f'{self.filename}.{index}.part'
+    def open_file(self, filename):
+        return self.soundfile.SoundFile(filename, 'w', SAMPLE_RATE, self.channels, 'PCM_16', format='FLAC')
+    def write(self, samples):
+        if len(samples) == 0: # an empty piece wouldn't be readable as a flac
+            return
+        if self.file is None:
+            self.parts.append(self.part_name(len(self.parts)))
+            self.file = self.open_file(self.parts[-1])
+        self.file.write(np.frombuffer(to_pcm16(samples), dtype='<i2').reshape(samples.shape))
+        self.frames += len(samples)
+    def flush(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    def abandon(self):
+        # leaves the pieces where they are, for carrying on from a checkpoint
+        self.flush()
+    def close(self):
+        self.flush()
+        if len(self.parts) == 1:
+            os.replace(self.parts[0], self.filename)
+            return
+        with self.open_file(self.filename) as output:
+            for part in self.parts:
+                with self.soundfile.SoundFile(part) as piece:
+                    for block in piece.blocks(10 * SAMPLE_RATE, dtype='int16'):
+                        output.write(block)
+        for part in self.parts:
+            os.remove(part)
+
+def audio_writer(filename, resume_frames=None, channels=1):
+    if filename.lower().endswith('.flac'):
+        return FlacWriter(filename, resume_frames, channels)
+    return WavWriter(filename, resume_frames, channels)
+
+# checkpoints of a render are laid out as SAVE_HEADER (with CHECKPOINT_MAGIC) and a json header saying how
+# far the render had got and what it was rendering, then whatever's left over from the last step to mix into
+# the next (float64), then the factory as a save file with its state
+CHECKPOINT_MAGIC = b'SFCHKPNT'
+
+def save_checkpoint(filename, factory, progress, overflow):
+    # written alongside and then moved over the old one, so there's always a whole checkpoint to go back to
+    header = dict(progress, overflow=list(overflow.shape), rng=DSP.rng.bit_generator.state)
+    encoded = json.dumps(header).encode()
+    with open(filename + '.new', 'wb') as file:
+        file.write(SAVE_HEADER.pack(CHECKPOINT_MAGIC, SAVE_VERSION, len(encoded)))
+        file.write(encoded)
+        write_array(file, overflow, 'f8')
+        save_factory(factory, file)
+    os.replace(filename + '.new', filename)
+
+def load_checkpoint(filename):
+    # returns (factory, progress, overflow), and puts the random numbers back as they were
+    with open(filename, 'rb') as file:
+        magic, version, header_length = SAVE_HEADER.unpack(file.read(SAVE_HEADER.size))
+        if magic != CHECKPOINT_MAGIC:
+            raise Exception(f'{filename} is not a render checkpoint')
+        header = json.loads(file.read(header_length))
+        shape = header.pop('overflow')
+        overflow = read_array(file, 'f8', tuple(shape) if isinstance(shape, list) else (shape,)).copy()
+        factory = load_saved_factory(file)
+    DSP.rng.bit_generator.state = header.pop('rng')
+    return factory, header, overflow
+
+def step_block(output, overflow, length, frame):
+    # a step's output (or None) with whatever ran over the end of the steps before mixed in, split into the
+    # length samples the step lasts for and what runs over into the next. frame is the shape of a sample
+    mix = np.zeros((length,) + frame) if output is None else output
+    block = np.zeros((max(length, len(mix), len(overflow)),) + frame)
+    block[:len(mix)] += mix
+    block[:len(overflow)] += overflow
+    return block[:length], block[length:]
+
+def render(factory, steps, filename, seconds=None, start=0, checkpoint=None, checkpoint_every=60, resume=None):
+    # run the factory as fast as possible with no display or audio device, streaming what the outputs produce
+    # to a wav or flac file (going by its extension, and in stereo if the mixer is) a step at a time, so
+    # memory use doesn't grow with the length of the render. each step takes up chunk_length seconds of the
+    # file (to the nearest sample, with the boundaries rounded as StepClock does so they don't drift), and
+    # anything that runs over the end of the step is mixed into the start of the next (see step_block). it
+    # covers steps steps, or seconds seconds if that's given, leaving out the first start seconds. with checkpoint, how far it's got is saved there every
+    # checkpoint_every steps, and removed once it's finished. to carry on from a checkpoint, load it with
+    # load_checkpoint and pass its factory as factory and its (progress, overflow) as resume.
+    channels = factory.mixer.channels
+    frame = () if channels == 1 else (channels,)
+    progress = {'output': filename, 'steps': steps, 'seconds': seconds, 'start': start, 'channels': channels,
+                'steps_done': 0, 'frames': 0}
+    overflow = np.zeros((0,) + frame)
+    resume_frames = None
+    if resume is not None:
+        saved, overflow = resume
+        saved.setdefault('channels', 1) # from before renders could be in stereo
+        if any(saved[key] != value for key, value in progress.items() if key not in ['steps_done', 'frames']):
+            raise Exception('the checkpoint is of a different render')
+        progress = saved
+        resume_frames = progress['frames']
+    step_samples = factory.chunk_length * SAMPLE_RATE
+    first = DSP.samples(start)
+    end = None if seconds is None else first + DSP.samples(seconds)
+    writer = audio_writer(filename, resume_frames, channels)
+    try:
+        while progress['steps_done'] < steps if end is None else round(progress['steps_done'] * step_samples) < end:
+            position = round(progress['steps_done'] * step_samples)
+            step_length = round((progress['steps_done'] + 1) * step_samples) - position
+            block, overflow = step_block(factory.step(), overflow, step_length, frame)
+            block = block[max(0, first - position):step_length if end is None else max(0, min(step_length, end - position))]
+            if len(block) > 0:
+                writer.write(block)
+            progress['steps_done'] += 1
+            progress['frames'] = writer.frames
+            if checkpoint is not None and progress['steps_done'] % checkpoint_every == 0:
+                writer.flush()
+                save_checkpoint(checkpoint, factory, progress, overflow)
+        if end is None:
+            writer.write(overflow[max(0, first - round(progress['steps_done'] * step_samples)):])
+    except BaseException:
+        writer.abandon()
+        raise
+    writer.close()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+class StepClock:
+    # decides which sample each step starts on when playing live. a step lasts 60/bpm seconds, which is rarely
+    # a whole number of samples, so rather than adding up rounded lengths (and drifting by up to half a sample
+    # a step) every boundary is rounded from where the current tempo started. steps come out a sample longer
+    # or shorter now and then but each one starts within half a sample of where it should, however long it
+    # plays for. it also keeps track of when steps are actually heard against when they should have been.
+    def __init__(self, history=1000):
+        self.errors = deque(maxlen=history) # seconds each recent step was heard late (or early, if negative)
+        self.heard_steps = 0
+        self.worst = 0
+        self.restart(0)
+    def restart(self, position):
+        # the next step starts on sample position, and everything after is timed from there
+        self.origin = position # where the current tempo started, in samples (not necessarily a whole number)
+        self.step_samples = None # samples per step at the current tempo
+        self.steps = 0 # steps since origin
+        self.position = position # the sample the next step starts on
+        self.reference = None # (position, time) of the first step heard since restarting
+    def advance(self, chunk_length):
+        # moves on by a step of chunk_length seconds, returning how many samples it lasts
+        step_samples = chunk_length * SAMPLE_RATE
+        if step_samples != self.step_samples:
+            if self.step_samples is not None:
+                self.origin += self.steps * self.step_samples
+            self.step_samples = step_samples
+            self.steps = 0
+        start = self.position
+        self.steps += 1
+        self.position = round(self.origin + (self.steps * step_samples))
+        return self.position - start
+    def heard(self, position, at):
+        # the step starting on sample position was heard at time.perf_counter() time at
+        reference = self.reference
+        if reference is None:
+            reference = self.reference = (position, at)
+        error = at - (reference[1] + ((position - reference[0]) / SAMPLE_RATE))
+        self.errors.append(error)
+        self.worst = max(self.worst, abs(error))
+        self.heard_steps += 1
+    def jitter(self):
+        # timing of recent steps in milliseconds, or None if none have been heard. mean is how far off they
+        # are on average, which creeps if the audio device's clock drifts, p95 and max are of the size of it
+        if len(self.errors) == 0:
+            return None
+        errors = np.array(self.errors) * 1000
+        return {'steps': self.heard_steps, 'mean_ms': float(errors.mean()),
+                'p95_ms': float(np.percentile(np.abs(errors), 95)), 'max_ms': 1000 * self.worst}
+
+class AudioStream:
+    # a single output stream that stays open the whole time the editor runs. the simulation writes each
+    # step's mix into a ring buffer ahead of time and the audio device pulls from it in buffer_size pieces,
+    # so steps join up without gaps. blocks that run over the end of their step are mixed into whatever
+    # gets written after them. if the device ever asks for more than has been written, that's an underrun.
+    # each write starts a step, and the step clock (if there is one) is told when the device reaches it. it's
+    # always stereo, and mono steps go out of both sides.
+    def __init__(self, buffer_size=1024, latency=0.25, capacity=16):
+        self.buffer_size = buffer_size # samples per device callback
+        self.latency = latency # seconds of audio to keep written ahead of playback
+        self.ring = np.zeros((DSP.samples(capacity), 2), dtype=np.float32)
+        self.read_position = 0 # both positions count samples since the stream started
+        self.write_position = 0
+        self.underruns = 0
+        self.playing = False # underruns aren't counted while paused
+        self.steps = deque() # positions of the steps written but not yet reached
+        self.step_clock = None # a StepClock
+        self.lock = threading.Lock()
+        self.device = None
+    def open(self):
+        import pygame._sdl2.audio as sdl_audio
+        import pygame._sdl2.sdl2 as sdl
+        sdl.init_subsystem(sdl.INIT_AUDIO)
+        devices = sdl_audio.get_audio_device_names(False)
+        if len(devices) == 0:
+            raise Exception('no audio output devices found')
+        self.device = sdl_audio.AudioDevice(devicename=devices[0], iscapture=False, frequency=SAMPLE_RATE,
+                                            audioformat=sdl_audio.AUDIO_F32, numchannels=2, chunksize=self.buffer_size,
+                                            allowed_changes=0, callback=self.callback)
+        self.device.pause(0)
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+            self.device = None
+    def queued(self):
+        # seconds of audio written but not yet played
+        return (self.write_position - self.read_position) / SAMPLE_RATE
+    def write(self, samples, advance):
+        # mixes samples in at the write position, then moves the write position on by advance samples
+        with self.lock:
+            needed = self.write_position + len(samples) - self.read_position
+            if needed > len(self.ring): # a very slow tempo, where a single step won't fit
+                self.grow(max(needed, 2 * len(self.ring)))
+            indices = (self.write_position + np.arange(len(samples))) % len(self.ring)
+            self.ring[indices] += samples if samples.ndim == 2 else samples[:,None]
+            self.steps.append(self.write_position)
+            self.write_position += advance
+    def grow(self, capacity):
+        positions = self.read_position + np.arange(len(self.ring))
+        ring = np.zeros((capacity, 2), dtype=np.float32)
+        ring[positions % capacity] = self.ring[positions % len(self.ring)]
+        self.ring = ring
+    def read(self, length):
+        now = time.perf_counter()
+        with self.lock:
+            indices = (self.read_position + np.arange(length)) % len(self.ring)
+            samples = self.ring[indices]
+            self.ring[indices] = 0
+            if self.write_position - self.read_position < length and self.playing:
+                self.underruns += 1
+            while len(self.steps) > 0 and self.steps[0] < self.read_position + length:
+                position = self.steps.popleft()
+                if self.step_clock is not None:
+                    self.step_clock.heard(position, now + ((position - self.read_position) / SAMPLE_RATE))
+            self.read_position += length
+            self.write_position = max(self.write_position, self.read_position)
+        return samples
+    def callback(self, device, buffer):
+        buffer[:] = np.clip(self.read(len(buffer) // 8), -1, 1).tobytes()
+
+class RenderedStep:
+    def __init__(self, output, chunk_length, state, steps_taken):
+        self.output = output # the mix from the outputs, or None
+        self.chunk_length = chunk_length # seconds the step lasts for
+        self.state = state # the factory's state after the step, see FactoryFloor.get_state
+        self.soundchunks = state[0]
+        self.steps_taken = steps_taken # by the factory, including this one
+
+class RenderAhead:
+    # steps the factory on a background thread, keeping steps_ahead steps rendered before they're needed so a
+    # slow step doesn't hold up the editor and a slow frame doesn't hold up the sound. whoever plays the steps
+    # takes them with next_step(), and the factory is always left in the state after the last step taken
+    # when it gets edited, so edits apply from the next step that hasn't been heard yet. the worker steps a
+    # copy of the factory rather than the factory itself, so the lock is only held while steps are handed
+    # over and an edit never has to wait for a step to finish. each edit bumps the generation, and a step
+    # from an older generation's copy is thrown away when it's done.
+    def __init__(self, factory, steps_ahead=2):
+        self.factory = factory
+        self.steps_ahead = steps_ahead
+        self.rendered = deque()
+        self.taken_state = factory.get_state()
+        self.taken_steps = factory.steps_taken
+        self.generation = 0
+        self.condition = threading.Condition(threading.RLock())
+        self.running = False
+        self.thread = None
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+    def pickled(factory):
+        # factory pickled to be copied, with the signals of its chunks (and any other arrays components are
+        # holding) left out, since they're never changed in place and the copy can share them. returns the
+        # pickle and the signals, for copy
+        signals = {id(chunk.signal): chunk.signal for chunk in factory.soundchunks.values()}
+        for values in factory.components.attributes.values():
+            for value in values.values():
+                if isinstance(value, SoundChunk):
+                    signals[id(value.signal)] = value.signal
+                elif isinstance(value, np.ndarray):
+                    signals[id(value)] = value
+        file = io.BytesIO()
+        pickler = pickle.Pickler(file, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda value: id(value) if isinstance(value, np.ndarray) and signals.get(id(value)) is value else None
+        pickler.dump(factory)
+        return file.getvalue(), signals
+    def copy(factory, pickled):
+        # a copy of factory to step from what pickled made of it, sharing whatever it's been given to run with
+        data, signals = pickled
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = lambda key: signals[key]
+        stepping = unpickler.load()
+        stepping.parallel = factory.parallel
+        if factory.steady_state is None:
+            stepping.steady_state = None
+        if factory.transit is None:
+            stepping.transit = None
+        return stepping
+    def work(self):
+        stepping = None
+        generation = None
+        while True:
+            with self.condition:
+                while self.running and len(self.rendered) >= self.steps_ahead:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                copying = generation != self.generation # edited since the copy was made, or there isn't one yet
+                if copying:
+                    pickled = RenderAhead.pickled(self.factory)
+                    generation = self.generation
+                profiler = self.factory.profiler
+            if copying:
+                stepping = RenderAhead.copy(self.factory, pickled)
+                with self.condition:
+                    # the copy has no timeline of its own, so the steps it takes are recorded in the factory's
+                    if generation == self.generation and self.factory.timeline is not None:
+                        self.factory.timeline.record(stepping)
+            stepping.profiler = profiler
+            started_at = time.monotonic()
+            chunk_length = stepping.chunk_length
+            output = stepping.step()
+            state = stepping.get_state()
+            for chunk in state[0].values():
+                if chunk.moved_at < started_at: # didn't move this step, so shouldn't be animated as if it did
+                    chunk.previous_location = chunk.location
+            with self.condition:
+                if generation == self.generation:
+                    self.rendered.append(RenderedStep(output, chunk_length, state, stepping.steps_taken))
+                    if self.factory.timeline is not None:
+                        self.factory.timeline.record(stepping)
+    def next_step(self):
+        # the next rendered step, or None if the worker hasn't got that far yet
+        with self.condition:
+            if len(self.rendered) == 0:
+                return None
+            rendered = self.rendered.popleft()
+            self.taken_state = rendered.state
+            self.taken_steps = rendered.steps_taken
+            self.condition.notify_all()
+        return rendered
+    @contextlib.contextmanager
+    def edit(self):
+        with self.condition:
+            self.factory.set_state(self.taken_state)
+            self.factory.steps_taken = self.taken_steps
+            self.rendered.clear()
+            yield
+            self.taken_state = self.factory.get_state()
+            self.taken_steps = self.factory.steps_taken
+            self.generation += 1
+            self.condition.notify_all()
+    def set_factory(self, factory):
+        with self.condition:
+            self.factory = factory
+            self.rendered.clear()
+            self.taken_state = factory.get_state()
+            self.taken_steps = factory.steps_taken
+            self.generation += 1
+            self.condition.notify_all()
+    def shown_chunks(self):
+        # a copy of the chunks as they were after the last step taken, for drawing until the next one's heard
+        with self.condition:
+            return {location: chunk.copy() for location, chunk in self.taken_state[0].items()}
+
+def run(factory=None, buffer_size=1024, latency=0.25, steps_ahead=2, trace_file=None, workers=1):
+    load_ui_modules()
     pg.init()
+    pg.mixer.quit() # sound goes through the AudioStream instead
     screen = pg.display.set_mode((1000,600))
+    pg.display.set_caption('sound factory')
+    Sprites.load()
     clock = pg.time.Clock()
-    delta_t_ms = 0
-    ui = FactoryUI(FactoryFloor(), [Oscillator, Conveyor, Output, Destroyer, ADSR, SplitPath, Delay, Squisher, Stretcher, Combine])
+    step_clock = StepClock()
+    stream = AudioStream(buffer_size, latency)
+    stream.step_clock = step_clock
+    try:
+        stream.open()
+    except Exception as e:
+        print(f'WARNING: could not open audio output, running without sound ({e})')
+        stream = None
+    underruns_shown = 0
+    ui = FactoryUI(factory or FactoryFloor(), COMPONENT_KINDS)
+    ui.trace_file = trace_file
+    ui.step_clock = step_clock
+    if trace_file is not None:
+        ui.factory.profiler = Profiler()
+    if workers > 1:
+        ui.factory.parallel = ParallelDSP(workers)
+    ui.factory.timeline = Timeline()
+    ui.scheduler = RenderAhead(ui.factory, steps_ahead)
+    ui.shown_chunks = ui.scheduler.shown_chunks()
+    ui.scheduler.start()
+    written = deque() # (stream position, chunks, steps taken) for steps written to the stream but not heard yet
+    played = 0 # without a stream, samples of time that have passed while playing, going by the system clock
+    last_frame = time.perf_counter()
+    was_running = False
     while True:
         for event in pg.event.get():
             if event.type == pg.QUIT:
+                ui.scheduler.stop()
+                if ui.factory.profiler is not None and ui.trace_file is not None:
+                    ui.factory.profiler.dump(ui.trace_file)
+                if ui.factory.parallel is not None:
+                    ui.factory.parallel.close()
+                if stream is not None:
+                    stream.close()
                 pg.quit()
                 return True
             elif event.type == pg.MOUSEBUTTONUP:
@@ -670,20 +3346,356 @@ def run():
                 ui.mousedrag(event.pos)
             elif event.type == pg.KEYUP:
                 ui.keyup(event)
-        if ui.playing:
-            delta_t_ms += clock.tick(30)
-        if delta_t_ms >= 1000 * ui.factory.chunk_length:
-            ui.factory.step()
-            delta_t_ms -= 1000 * ui.factory.chunk_length
-        ui.draw(screen)
-
-        pg.display.flip()
-
-
+        clock.tick(30)
+        if ui.jumped: # what's been written is from before it was seeked, so it shouldn't be shown
+            written.clear()
+            ui.jumped = False
+        running = ui.playing and ui.factory.settings['bpm'].get_value() > 0
+        if stream is None:
+            # steps can only be taken once a frame, so they're up to a frame late, but they're timed against
+            # where they should start rather than the last one, so the lateness doesn't add up
+            now = time.perf_counter()
+            if running and not was_running:
+                step_clock.restart(step_clock.position)
+            if running:
+                played += (now - last_frame) * SAMPLE_RATE
+            last_frame = now
+            while running and step_clock.position <= played:
+                rendered = ui.scheduler.next_step()
+                if rendered is None:
+                    break
+                step_clock.heard(step_clock.position, now)
+                step_clock.advance(rendered.chunk_length)
+                written.append((0, rendered.soundchunks, rendered.steps_taken))
+        else:
+            stream.playing = running
+            while running and stream.queued() < stream.latency:
+                rendered = ui.scheduler.next_step()
+                if rendered is None:
+                    break
+                if stream.write_position != step_clock.position: # after a pause or an underrun
+                    step_clock.restart(stream.write_position)
+                written.append((stream.write_position, rendered.soundchunks, rendered.steps_taken))
+                length = step_clock.advance(rendered.chunk_length)
+                stream.write(rendered.output if rendered.output is not None else np.zeros(0, dtype=np.float32), length)
+        was_running = running
+        while len(written) > 0 and (stream is None or written[0][0] <= stream.read_position):
+            position, ui.shown_chunks, ui.shown_step = written.popleft()
+            for chunk in ui.shown_chunks.values():
+                chunk.moved_at = time.monotonic()
+            if stream is not None and stream.underruns != underruns_shown:
+                underruns_shown = stream.underruns
+                pg.display.set_caption(f'sound factory ({underruns_shown} audio underruns)')
+        dirty = ui.draw(screen)
+        if dirty is None:
+            pg.display.flip()
+        else:
+            pg.display.update(dirty)
 
+class Session:
+    # one factory hosted by a FactoryServer, stepped on its own clock. while it's playing, each step is
+    # worked out ahead seconds before it's due (on a worker thread, so other sessions carry on meanwhile) and
+    # its audio is queued for clients to pull. while it's paused, or at 0 bpm, it waits for something to
+    # change rather than waking up, so idle sessions cost nothing.
+    def __init__(self, name, factory, ahead=0.25, max_queued=10):
+        self.name = name
+        self.factory = factory
+        self.ahead = ahead # seconds before a step is due that it gets worked out
+        self.max_queued = max_queued # seconds of audio kept for clients to pull, beyond which the oldest is dropped
+        self.playing = True
+        self.step_clock = StepClock()
+        self.start = None # (loop time, sample position) the clock's timed from, set when it starts playing
+        self.queued = deque() # (sample position, block) for audio not pulled yet
+        self.queued_frames = 0
+        self.dropped = 0 # frames dropped because nobody pulled them in time
+        self.overflow = np.zeros(0)
+        self.steps = 0
+        self.lock = asyncio.Lock() # held while stepping and editing, so edits land between steps
+        self.changed = asyncio.Event()
+        self.task = None
+    def running(self):
+        return self.playing and self.factory.settings['bpm'].get_value() > 0
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.running():
+                self.start = None
+                self.changed.clear()
+                await self.changed.wait()
+                continue
+            if self.start is None:
+                self.start = (loop.time() + self.ahead, self.step_clock.position)
+                self.step_clock.restart(self.step_clock.position)
+            due = self.start[0] + ((self.step_clock.position - self.start[1]) / SAMPLE_RATE)
+            wait = due - self.ahead - loop.time()
+            if wait > 0:
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), wait)
+                    continue # something changed, so check again whether to play
+                except asyncio.TimeoutError:
+                    pass
+            async with self.lock:
+                position = self.step_clock.position
+                chunk_length = self.factory.chunk_length
+                output = await asyncio.to_thread(self.factory.step)
+                self.step_clock.heard(position, loop.time() + self.ahead)
+                self.queue(position, output, self.step_clock.advance(chunk_length))
+    def queue(self, position, output, length):
+        frame = () if self.factory.mixer.channels == 1 else (self.factory.mixer.channels,)
+        if self.overflow.shape[1:] != frame: # the stereo width was changed
+            self.overflow = self.overflow.mean(axis=1) if frame == () else np.repeat(self.overflow[:,None], frame[0], axis=1)
+        block, self.overflow = step_block(output, self.overflow, length, frame)
+        self.queued.append((position, block.astype(np.float32)))
+        self.queued_frames += len(block)
+        self.steps += 1
+        while self.queued_frames > DSP.samples(self.max_queued) and len(self.queued) > 1:
+            dropped = len(self.queued.popleft()[1])
+            self.dropped += dropped
+            self.queued_frames -= dropped
+    def pull(self, max_frames=None):
+        # (sample position of the first frame, frames as a float32 array) for the audio queued since the last
+        # pull, in stereo if any of it is
+        if len(self.queued) == 0:
+            return self.step_clock.position, np.zeros(0, dtype=np.float32)
+        position = self.queued[0][0]
+        blocks = []
+        frames = 0
+        while len(self.queued) > 0 and (max_frames is None or frames + len(self.queued[0][1]) <= max_frames or frames == 0):
+            blocks.append(self.queued.popleft()[1])
+            frames += len(blocks[-1])
+        self.queued_frames -= frames
+        if any(block.ndim == 2 for block in blocks):
+            blocks = [block if block.ndim == 2 else np.repeat(block[:,None], 2, axis=1) for block in blocks]
+        return position, np.concatenate(blocks)
+    def status(self):
+        return {'session': self.name, 'playing': self.playing, 'bpm': self.factory.settings['bpm'].get_value(),
+                'position': self.step_clock.position, 'steps': self.steps, 'chunks': len(self.factory.soundchunks),
+                'components': len(self.factory.components), 'queued_frames': self.queued_frames,
+                'dropped_frames': self.dropped, 'timing': self.step_clock.jitter()}
 
+class FactoryServer:
+    # hosts lots of factories in one process, each a Session, for clients to edit and pull audio from over a
+    # local socket (a unix socket, or a tcp port on localhost). requests and responses are lines of json;
+    # a pull's response is followed by the number of bytes of little-endian float32 samples it says. every
+    # request but sessions names the session it's for, and gets back {"ok": true, ...} or {"ok": false,
+    # "error": ...}. see FactoryServer.request for what they can do. clients can only open, save and play
+    # files in directory (none at all if it's None), and only factories saved in the current format, since
+    # loading an old pickled one could run anything.
+    def __init__(self, ahead=0.25, max_queued=10, directory=None):
+        self.ahead = ahead
+        self.max_queued = max_queued
+        self.directory = directory
+        self.sessions = {}
+    async def serve(self, address):
+        if isinstance(address, int):
+            server = await asyncio.start_server(self.handle, '127.0.0.1', address)
+        else:
+            umask = os.umask(0o177) # so the socket's only for whoever's running the server from the start
+            try:
+                server = await asyncio.start_unix_server(self.handle, address)
+            finally:
+                os.umask(umask)
+        async with server:
+            await server.serve_forever()
+    async def handle(self, reader, writer):
+        try:
+            while (line := await reader.readline()):
+                payload = b''
+                try:
+                    response = await self.request(json.loads(line))
+                    if isinstance(response, tuple):
+                        response, samples = response
+                        payload = samples.astype('<f4').tobytes()
+                        response['bytes'] = len(payload)
+                    response = dict(response, ok=True)
+                except Exception as e:
+                    response = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(response).encode() + b'\n' + payload)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    def open(self, name, factory=None):
+        if name in self.sessions:
+            raise Exception(f'there\'s already a session called {name}')
+        session = Session(name, factory or FactoryFloor(), self.ahead, self.max_queued)
+        session.task = asyncio.get_running_loop().create_task(session.run())
+        self.sessions[name] = session
+        return session
+    def close(self, name):
+        self.sessions.pop(name).task.cancel()
+    def path(self, filename):
+        # where filename is in the server's directory, as long as it's in there
+        if self.directory is None:
+            raise Exception('the server hasn\'t been given a directory for files')
+        directory = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(directory, filename))
+        if os.path.commonpath([directory, path]) != directory:
+            raise Exception(f'{filename} isn\'t in the server\'s directory')
+        return path
+    def component_kind(name):
+        for kind in COMPONENT_KINDS:
+            if name.lower() in [kind.__name__.lower(), kind.name.lower()]:
+                return kind
+        raise Exception(f'unknown component kind: {name}')
+    def direction(name):
+        directions = {'north': Compass.NORTH, 'east': Compass.EAST, 'south': Compass.SOUTH, 'west': Compass.WEST}
+        if name not in directions:
+            raise Exception(f'unknown direction: {name}')
+        return directions[name]
+    def checked_value(widget, value):
+        if isinstance(widget, MultipleChoiceSetting):
+            if value not in widget.options:
+                raise Exception(f'{widget.name} has to be one of {", ".join(map(str, widget.options))}')
+            return value
+        return max(widget.minimum, min(widget.maximum, float(value)))
+    async def request(self, request):
+        op = request.get('op')
+        if op == 'sessions':
+            return {'sessions': [session.status() for session in self.sessions.values()]}
+        name = request.get('session')
+        if op == 'open':
+            factory = None
+            if request.get('factory') is not None:
+                with open(self.path(request['factory']), 'rb') as file:
+                    if file.read(len(SAVE_MAGIC)) != SAVE_MAGIC:
+                        raise Exception(f'{request["factory"]} isn\'t a factory saved in the current format')
+                    file.seek(0)
+                    factory = load_saved_factory(file)
+                # the files its sample players play have to be in the directory too
+                files = factory.components.attributes['sample_file']
+                for row, filename in files.items():
+                    files[row] = self.path(filename)
+            session = self.open(name, factory)
+            session.playing = request.get('playing', True)
+            return session.status()
+        if name not in self.sessions:
+            raise Exception(f'no session called {name}')
+        session = self.sessions[name]
+        if op == 'close':
+            self.close(name)
+            return {}
+        if op == 'status':
+            return session.status()
+        if op == 'pull':
+            position, samples = session.pull(request.get('max_frames'))
+            return {'position': position, 'frames': len(samples), 'channels': 1 if samples.ndim == 1 else samples.shape[1],
+                    'dropped_frames': session.dropped}, samples
+        async with session.lock:
+            factory = session.factory
+            if op in ['play', 'pause']:
+                session.playing = op == 'play'
+            elif op == 'place':
+                factory.create_component(FactoryServer.component_kind(request['kind']), tuple(request['location']),
+                                         FactoryServer.direction(request.get('direction', 'north')))
+            elif op == 'rotate':
+                location = tuple(request['location'])
+                if location not in factory.components:
+                    raise Exception(f'nothing at {list(location)} to rotate')
+                factory.components[location].rotate()
+            elif op == 'remove':
+                factory.remove_component(tuple(request['location']))
+            elif op == 'set':
+                if request.get('location') is None:
+                    if request['name'] not in factory.settings:
+                        raise Exception(f'no factory setting called {request["name"]}')
+                    widget = factory.settings[request['name']]
+                    widget.set_value(FactoryServer.checked_value(widget, request['value']))
+                    factory.settings_changed()
+                else:
+                    location = tuple(request['location'])
+                    if location not in factory.components:
+                        raise Exception(f'nothing at {list(location)} to change the settings of')
+                    component = factory.components[location]
+                    widgets = component.make_settings()
+                    if isinstance(component, SamplePlayer) and request['name'] == 'file':
+                        component.choose_file(self.path(request['value']))
+                    elif request['name'] not in widgets:
+                        raise Exception(f'{component.name} has no setting called {request["name"]}')
+                    else:
+                        component.set_setting(request['name'], FactoryServer.checked_value(widgets[request['name']], request['value']))
+                        component.settings_changed()
+            elif op == 'save':
+                with open(self.path(request['path']), 'wb') as file:
+                    save_factory(factory, file)
+            else:
+                raise Exception(f'unknown request: {op}')
+        session.changed.set()
+        return session.status()
 
-run()
+def serve(address, ahead=0.25, max_queued=10, factories=(), directory=None):
+    # runs a FactoryServer until it's interrupted, with a session for each of factories (name, factory) to start with
+    server = FactoryServer(ahead, max_queued, directory)
+    async def start():
+        for name, factory in factories:
+            server.open(name, factory)
+        await server.serve(address)
+    try:
+        asyncio.run(start())
+    except KeyboardInterrupt:
+        pass
 
+def main(args=None):
+    parser = argparse.ArgumentParser(description='the sound factory. with no arguments, opens the editor.')
+    parser.add_argument('factory', nargs='?', help='a saved factory to open')
+    parser.add_argument('-o', '--output', help='render the factory to this wav or flac file without opening the editor. flac needs the soundfile module')
+    parser.add_argument('-c', '--convert', help='save the factory in the current format to this file (eg. to upgrade an old save) without opening the editor')
+    parser.add_argument('-n', '--steps', type=int, default=60, help='number of steps to render (default 60)')
+    parser.add_argument('-t', '--seconds', type=float, help='render this many seconds rather than a number of steps')
+    parser.add_argument('--start', type=float, default=0, help='leave this many seconds at the start out of the render (default 0)')
+    parser.add_argument('--checkpoint', metavar='FILE', help='when rendering, save how far it\'s got to this file every so often so a render that gets stopped can be carried on. if the file is already there, the render carries on from it')
+    parser.add_argument('--checkpoint-every', type=int, default=60, help='steps between checkpoints (default 60)')
+    parser.add_argument('--profile', metavar='TRACE', help='time each part of the factory as it runs and write a trace file (chrome trace event format) at the end. in the editor, P turns profiling on and off')
+    parser.add_argument('--buffer-size', type=int, default=1024, help='samples per audio device buffer in the editor (default 1024)')
+    parser.add_argument('--latency', type=float, default=0.25, help='seconds of audio the editor renders ahead of playback, or the server works out ahead of when it\'s due (default 0.25)')
+    parser.add_argument('--steps-ahead', type=int, default=2, help='steps the editor simulates ahead of what\'s being heard (default 2)')
+    parser.add_argument('--stream-regions', metavar='DIRECTORY', help='when rendering, keep only some regions of the factory in memory and write the idle ones to files in this directory')
+    parser.add_argument('--max-regions', type=int, default=64, help=f'regions of {SparseGrid.region_size}x{SparseGrid.region_size} tiles to keep in memory with --stream-regions (default 64)')
+    parser.add_argument('--no-loops', action='store_true', help='when rendering, simulate every step, even once the factory has settled into a loop whose steps could be replayed')
+    parser.add_argument('--serve', metavar='ADDRESS', help='host factories for clients to edit and pull audio from over a unix socket at ADDRESS, or a tcp port on localhost if it\'s a number, rather than opening the editor. the factory given, if any, is opened as a session named after its file. see FactoryServer for the protocol')
+    parser.add_argument('--serve-directory', metavar='DIRECTORY', help='the directory clients of --serve can open and save factories and choose samples in, by paths relative to it. without it they can\'t use files at all')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='processes to spread the audio processing of big factories over (default 1, which does it all in this one). the result is the same whatever this is')
+    args = parser.parse_args(args)
+    factory = None
+    if args.factory is not None:
+        with open(args.factory, 'rb') as file:
+            factory = load_factory(file)
+    if args.convert is not None:
+        if factory is None:
+            parser.error('converting needs a saved factory to convert')
+        with open(args.convert, 'wb') as file:
+            save_factory(factory, file)
+    elif args.serve is not None:
+        factories = [] if factory is None else [(os.path.splitext(os.path.basename(args.factory))[0], factory)]
+        serve(int(args.serve) if args.serve.isdigit() else args.serve, args.latency, factories=factories, directory=args.serve_directory)
+    elif args.output is not None:
+        resume = None
+        if args.checkpoint is not None and os.path.exists(args.checkpoint):
+            factory, progress, overflow = load_checkpoint(args.checkpoint)
+            resume = (progress, overflow)
+        if factory is None:
+            parser.error('rendering needs a saved factory to render')
+        if args.profile is not None:
+            factory.profiler = Profiler()
+        if args.workers > 1:
+            factory.parallel = ParallelDSP(args.workers)
+        if args.no_loops:
+            factory.steady_state = None
+        if args.stream_regions is not None:
+            os.makedirs(args.stream_regions, exist_ok=True)
+            factory.stream_regions(args.stream_regions, args.max_regions)
+        try:
+            render(factory, args.steps, args.output, args.seconds, args.start, args.checkpoint, args.checkpoint_every, resume)
+        finally:
+            if factory.parallel is not None:
+                factory.parallel.close()
+        if args.profile is not None:
+            factory.profiler.dump(args.profile)
+    else:
+        run(factory, args.buffer_size, args.latency, args.steps_ahead, args.profile, args.workers)
 
 
+if __name__ == '__main__':
+    main()
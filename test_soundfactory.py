@@ -0,0 +1,87 @@
+import os
+import pytest
+import numpy as np
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import soundfactory as sf
+from soundfactory import Compass
+
+# the fast paths (running jobs on worker processes, replaying a steady state, moving blocks along compiled
+# conveyors) are only meant to make stepping quicker, so a factory has to do exactly the same thing with each
+# of them on as with all of them off.
+
+STEPS = 60
+
+def build():
+    # one fixed factory with a bit of everything, and enough effects each step for the jobs to go to workers
+    factory = sf.FactoryFloor()
+    waveforms = ['sine', 'square', 'sawtooth', 'triangle']
+    notes = sf.Oscillator.make_settings()['frequency'].options
+    chain = [sf.Oscillator, sf.ADSR, sf.Conveyor, sf.Combine, sf.Squisher, sf.Stretcher, sf.Delay, sf.ADSR, sf.Conveyor, sf.Output]
+    for y in range(6):
+        for x, kind in enumerate(chain):
+            factory.create_component(kind, (x,y*2), Compass.EAST if kind is not sf.Output else Compass.NORTH)
+        oscillator = factory.components[(0,y*2)]
+        oscillator.set_setting('waveform', waveforms[y % 4])
+        oscillator.set_setting('frequency', notes[(y * 5) % len(notes)])
+        oscillator.settings_changed()
+    # an oscillator into a split path, with a conveyor line either side down to an output
+    factory.create_component(sf.Oscillator, (4,14), Compass.SOUTH)
+    factory.create_component(sf.SplitPath, (4,15), Compass.SOUTH)
+    for branch, direction in [(-1, Compass.WEST), (1, Compass.EAST)]:
+        for step in range(1, 4):
+            factory.create_component(sf.Conveyor, (4 + (branch*step), 15), direction)
+        factory.create_component(sf.Conveyor, (4 + (branch*4), 15), Compass.SOUTH)
+        factory.create_component(sf.Output, (4 + (branch*4), 16), Compass.NORTH)
+    return factory
+
+def run(parallel=None, steady_state=False, transit=False):
+    sf.Oscillator.waveform_cache.clear()
+    factory = build()
+    factory.parallel = parallel
+    if not steady_state:
+        factory.steady_state = None
+    if not transit:
+        factory.transit = None
+    steps = []
+    for _ in range(STEPS):
+        output = factory.step()
+        chunks = [(location, chunk.velocity, chunk.signal.tobytes()) for location, chunk in factory.soundchunks.items()]
+        steps.append((None if output is None else output.tobytes(), chunks))
+    return factory, steps
+
+@pytest.fixture(scope='module')
+def reference():
+    return run()[1]
+
+@pytest.fixture(scope='module')
+def parallel():
+    parallel = sf.ParallelDSP(2)
+    yield parallel
+    parallel.close()
+
+def assert_same(steps, reference):
+    assert len(steps) == len(reference)
+    for step, (got, expected) in enumerate(zip(steps, reference)):
+        assert got[0] == expected[0], f'output differs on step {step}'
+        assert got[1] == expected[1], f'blocks differ on step {step}'
+
+def test_reference_makes_sound(reference):
+    assert sum(output is not None for output, chunks in reference) > STEPS // 2
+
+def test_parallel(reference, parallel):
+    factory, steps = run(parallel=parallel)
+    assert_same(steps, reference)
+
+def test_steady_state(reference):
+    factory, steps = run(steady_state=True)
+    assert factory.steady_state.looping() # otherwise nothing was replayed
+    assert_same(steps, reference)
+
+def test_transit(reference):
+    factory, steps = run(transit=True)
+    assert len(factory.transit.directions) > 0
+    assert_same(steps, reference)
+
+def test_all(reference, parallel):
+    factory, steps = run(parallel, steady_state=True, transit=True)
+    assert_same(steps, reference)